@@ -4,11 +4,11 @@ This file contains functions for handling general conversations.
 """
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 import pytz
-from openai import OpenAI
 
-from agents.general_agent.general_db import store_conversation, get_conversation_history
+from agents.general_agent.general_db import queue_conversation, queue_conversation_turn, get_conversation_history
+from utils.llm_utils import get_openai_client
 
 logger = logging.getLogger(__name__)
 
@@ -28,8 +28,8 @@ def get_ai_response(user_message, conversation_history=None, system_prompt=None,
     # Add the user's message
     messages.append({"role": "user", "content": user_message})
     
-    # Use the new OpenAI API format
-    client = OpenAI()
+    # Shared client, so calls reuse pooled connections
+    client = get_openai_client()
     
     response = client.chat.completions.create(
         model="gpt-4o-mini",
@@ -39,26 +39,35 @@ def get_ai_response(user_message, conversation_history=None, system_prompt=None,
     
     return response.choices[0].message.content
 
-def handle_message(from_number, message_body, message_type='text'):
+def prepare_response(from_number, message_body, message_type='text'):
+    """
+    Generate the AI reply for a message without storing anything,
+    so it can be started speculatively before the intent is known.
+    """
+    conversation_history = get_conversation_context(from_number)
+    return get_ai_response(message_body, conversation_history, is_audio_transcription=(message_type == 'audio'))
+
+def handle_message(from_number, message_body, message_type='text', response_future=None):
     """
     Process an incoming message and generate a response.
+    response_future may hold a reply already being generated by prepare_response.
     """
+    received_at = datetime.now(timezone.utc)
     try:
-        # Store the incoming message
-        store_conversation(from_number, message_body, message_type, True)
-        
-        # Get conversation history for context
-        conversation_history = get_conversation_context(from_number)
-        
-        # Get AI response for general conversation
-        response = get_ai_response(message_body, conversation_history, is_audio_transcription=(message_type == 'audio'))
+        # Get AI response for general conversation, unless it was started speculatively
+        if response_future is not None:
+            response = response_future.result()
+        else:
+            response = prepare_response(from_number, message_body, message_type)
         
-        # Store the response
-        store_conversation(from_number, response, 'text', False)
+        # Store the message and the response (bulk-inserted in the background)
+        queue_conversation_turn(from_number, message_body, message_type, response, received_at)
         
         return response
     except Exception as e:
         logger.error(f"Error handling message: {str(e)}")
+        # Keep the user's message in the history even without a reply
+        queue_conversation(from_number, message_body, message_type, True)
         return "Desculpe, ocorreu um erro ao processar sua mensagem."
 
 def get_conversation_context(from_number, limit=5):
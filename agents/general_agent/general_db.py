@@ -2,7 +2,10 @@
 Conversation history and general DB operations.
 This file contains functions for managing conversation history.
 """
+import atexit
 import logging
+from datetime import datetime, timezone
+from utils.batching import BatchWorker
 from utils.database import supabase
 
 logger = logging.getLogger(__name__)
@@ -25,6 +28,67 @@ def store_conversation(user_phone, message_content, message_type, is_from_user,
         logger.error(f"Error storing message in database: {str(e)}")
         return False
 
+def _conversation_row(user_phone, message_content, message_type, is_from_user, agent, created_at):
+    """Build a conversations row; an explicit created_at keeps rows of one batch in order"""
+    return {
+        'user_phone': user_phone,
+        'message_content': message_content,
+        'message_type': message_type,
+        'is_from_user': is_from_user,
+        'agent': agent,
+        'created_at': created_at.isoformat()
+    }
+
+class ConversationWriter(BatchWorker):
+    """
+    Buffers conversation rows and writes them in bulk from a background thread,
+    so many turns share one round-trip to Supabase.
+    """
+    
+    def __init__(self, max_batch_size=50, max_wait=0.5):
+        """Insert up to max_batch_size rows at a time, waiting at most max_wait seconds"""
+        super().__init__("conversation-writer", max_batch_size, max_wait)
+    
+    def put(self, rows):
+        """Queue rows for insertion"""
+        for row in rows:
+            self.submit(row)
+    
+    def flush(self, timeout=5):
+        """
+        Stop the writer and insert every row still queued (used at shutdown).
+        The writer finishes the batch it is holding first; if that insert takes longer
+        than timeout, rows queued behind it are inserted here and may land out of order.
+        """
+        self.stop(timeout)
+        batch = self.drain()
+        if batch:
+            self.process_batch(batch)
+    
+    def process_batch(self, batch):
+        """Insert a batch of rows with a single request"""
+        try:
+            supabase.table('conversations').insert(batch).execute()
+            logger.info(f"Stored {len(batch)} conversation messages in database")
+        except Exception as e:
+            logger.error(f"Error storing {len(batch)} conversation messages in database: {str(e)}")
+
+conversation_writer = ConversationWriter()
+atexit.register(conversation_writer.flush)
+
+def queue_conversation_turn(user_phone, user_message, message_type, response, received_at, agent="DEFAULT"):
+    """Queue a user message and the agent's reply for the next bulk insert"""
+    conversation_writer.put([
+        _conversation_row(user_phone, user_message, message_type, True, agent, received_at),
+        _conversation_row(user_phone, response, 'text', False, agent, datetime.now(timezone.utc))
+    ])
+
+def queue_conversation(user_phone, message_content, message_type, is_from_user, agent="DEFAULT"):
+    """Queue a single message for the next bulk insert"""
+    conversation_writer.put([
+        _conversation_row(user_phone, message_content, message_type, is_from_user, agent, datetime.now(timezone.utc))
+    ])
+
 def get_conversation_history(user_phone, limit=10):
     """Get recent conversation history for a user"""
     try:
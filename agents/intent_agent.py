@@ -3,12 +3,307 @@ Intent classification module.
 This file contains the IntentAgent class for detecting different types of intents in messages.
 """
 import logging
-import json
+import orjson
+import re
+import threading
+import numpy as np
 import openai
 import time as time_module
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from utils.batching import BatchWorker
+from utils.llm_utils import get_openai_client
 
 logger = logging.getLogger(__name__)
 
+# Optional local embedding model for the semantic cache
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# High-confidence keyword patterns, checked in order before calling the LLM
+HIGH_CONFIDENCE_PATTERNS = (
+    ("create", re.compile(r'\b(?:me lembr[ae]|lembre-me|me avis[ae])\b')),
+    ("list", re.compile(r'\b(?:meus lembretes|listar lembretes|ver lembretes)\b')),
+    ("cancel", re.compile(r'\b(?:cancelar lembrete|apagar lembrete|remover lembrete)\b')),
+)
+
+# Messages about these topics are general conversation, unless they mention reminders
+NO_REMINDER_RE = re.compile(r'\b(?:tempo|clima|como está)\b')
+REMINDER_HINT_RE = re.compile(r'lembr|avis')
+
+# Messages outside this length band, or made only of digits or a URL, are never
+# sent to the classifier (greetings, confirmation codes, pasted articles, links)
+MIN_CLASSIFIABLE_LENGTH = 3
+MAX_CLASSIFIABLE_LENGTH = 400
+DIGITS_ONLY_RE = re.compile(r'[\d\s.,/-]+')
+URL_ONLY_RE = re.compile(r'https?://\S+')
+
+class SemanticIntentCache:
+    """
+    In-memory cache of intent results keyed by message embeddings.
+    A message whose embedding is close enough to a cached one reuses its intent,
+    so paraphrases of earlier messages skip the chat completion call.
+    Embeddings are computed locally with sentence-transformers; without it the cache
+    is disabled, since an embeddings API call would cost a round-trip of its own.
+    """
+    
+    def __init__(self, threshold=0.92, max_size=10000, model="all-MiniLM-L6-v2", dimensions=384):
+        """Initialize an empty cache with FIFO eviction once max_size is reached"""
+        self.threshold = threshold
+        self.max_size = max_size
+        self.model = model
+        self.dimensions = dimensions
+        self.enabled = SentenceTransformer is not None
+        self._encoder = None
+        self._encoder_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # Allocated on first add, so a disabled cache costs no memory
+        self._embeddings = None
+        self._results = [None] * max_size
+        self._size = 0
+        self._next = 0
+    
+    def _get_encoder(self):
+        """Load the local embedding model on first use"""
+        if self._encoder is None:
+            with self._encoder_lock:
+                if self._encoder is None:
+                    self._encoder = SentenceTransformer(self.model)
+                    logger.info(f"IntentAgent: Loaded local embedding model {self.model}")
+        return self._encoder
+    
+    def embed(self, text):
+        """Return the normalized embedding of a message"""
+        embedding = self._get_encoder().encode(text, normalize_embeddings=True)
+        return np.asarray(embedding, dtype=np.float32)
+    
+    def lookup(self, embedding):
+        """Return the cached result for the most similar message, or None"""
+        with self._lock:
+            if not self._size:
+                return None
+            
+            # Embeddings are unit length, so one matrix-vector product gives all cosine similarities
+            similarities = self._embeddings[:self._size] @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                logger.info("IntentAgent: Semantic cache hit (similarity %.3f)", similarities[best])
+                return self._results[best]
+        
+        return None
+    
+    def add(self, embedding, result):
+        """Store a result, overwriting the oldest entry when the cache is full"""
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_size, self.dimensions), dtype=np.float32)
+            self._embeddings[self._next] = embedding
+            self._results[self._next] = result
+            self._next = (self._next + 1) % self.max_size
+            self._size = min(self._size + 1, self.max_size)
+
+semantic_intent_cache = SemanticIntentCache()
+
+# Static, byte-identical system prompt so repeated calls share a cacheable prefix
+_INTENT_SYSTEM_PROMPT = """
+Classifique a intenção da mensagem do usuário (em português) chamando classify_intent.
+Use "reminder" para pedidos sobre lembretes: criar, listar ou cancelar.
+Use "general" para qualquer outra coisa.
+""".strip()
+
+# Same instructions for a numbered list of messages classified in one call
+_BATCH_INTENT_SYSTEM_PROMPT = """
+Classifique a intenção de cada mensagem numerada do usuário (em português) chamando classify_intents,
+com um valor por mensagem, na mesma ordem.
+Use "reminder" para pedidos sobre lembretes: criar, listar ou cancelar.
+Use "general" para qualquer outra coisa.
+""".strip()
+
+# System messages are built once and shared by every request (they are never mutated)
+_INTENT_SYSTEM_MESSAGE = {"role": "system", "content": _INTENT_SYSTEM_PROMPT}
+_BATCH_INTENT_SYSTEM_MESSAGE = {"role": "system", "content": _BATCH_INTENT_SYSTEM_PROMPT}
+
+# Function schemas forcing the model to answer with enum values only; strict mode has
+# the API enforce the schema, so the arguments always parse and validate
+INTENT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "classify_intent",
+        "description": "Registra a intenção da mensagem do usuário",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "intent_type": {"type": "string", "enum": ["reminder", "general"]}
+            },
+            "required": ["intent_type"],
+            "additionalProperties": False
+        }
+    }
+}
+
+BATCH_INTENT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "classify_intents",
+        "description": "Registra a intenção de cada mensagem, na mesma ordem",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "intent_types": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": ["reminder", "general"]}
+                }
+            },
+            "required": ["intent_types"],
+            "additionalProperties": False
+        }
+    }
+}
+
+def _request_intents(normalized_messages):
+    """
+    Classify one or more normalized messages with a single LLM call.
+    Returns the intent types in the same order as the messages.
+    """
+    logger.info("IntentAgent: Detecting reminder intent with LLM for %d message(s)", len(normalized_messages))
+    
+    if len(normalized_messages) == 1:
+        system_message = _INTENT_SYSTEM_MESSAGE
+        user_content = normalized_messages[0]
+        tool = INTENT_TOOL
+    else:
+        system_message = _BATCH_INTENT_SYSTEM_MESSAGE
+        # Messages are whitespace-normalized, so each one fits on its own line
+        user_content = "\n".join(f"{i}. {m}" for i, m in enumerate(normalized_messages, 1))
+        tool = BATCH_INTENT_TOOL
+    
+    start_time = time_module.time()
+    
+    client = get_openai_client()
+    
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[system_message, {"role": "user", "content": user_content}],
+        temperature=0.1,
+        tools=[tool],
+        tool_choice={"type": "function", "function": {"name": tool["function"]["name"]}}
+    )
+    
+    elapsed_time = time_module.time() - start_time
+    
+    if not response.choices or not response.choices[0].message.tool_calls:
+        logger.error("IntentAgent: Failed to get response from LLM")
+        raise ValueError("IntentAgent: Failed to get response from LLM")
+    
+    response_text = response.choices[0].message.tool_calls[0].function.arguments
+    
+    # Parse the JSON response
+    try:
+        result = orjson.loads(response_text)
+    except orjson.JSONDecodeError:
+        logger.error("IntentAgent: Failed to parse LLM response as JSON")
+        raise ValueError("IntentAgent: Failed to parse LLM response as JSON")
+    
+    logger.info("IntentAgent: LLM intent detection result: %s (took %.2fs)", result, elapsed_time)
+    
+    if len(normalized_messages) == 1:
+        return [result.get("intent_type")]
+    
+    intent_types = result.get("intent_types") or []
+    if len(intent_types) != len(normalized_messages):
+        logger.error("IntentAgent: LLM returned a different number of intents than messages")
+        raise ValueError("IntentAgent: LLM returned a different number of intents than messages")
+    
+    return intent_types
+
+class IntentBatcher(BatchWorker):
+    """
+    Coalesces concurrent intent classifications into a single LLM call.
+    A burst of webhooks arriving within max_wait shares one round-trip.
+    """
+    
+    def __init__(self, max_batch_size=8, max_wait=0.02):
+        """Batch up to max_batch_size messages, waiting at most max_wait seconds"""
+        super().__init__("intent-batcher", max_batch_size, max_wait)
+    
+    def classify(self, normalized_message):
+        """Classify a message, blocking until its batch has been answered"""
+        future = Future()
+        self.submit((normalized_message, future))
+        return future.result()
+    
+    def process_batch(self, batch):
+        """Classify a batch of messages and resolve their futures"""
+        try:
+            intent_types = _request_intents([message for message, _ in batch])
+            for (_, future), intent_type in zip(batch, intent_types):
+                future.set_result(intent_type)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
+intent_batcher = IntentBatcher()
+
+# Exact-match tier in front of the semantic cache; short commands repeat often, and
+# an entry is only a normalized message and its intent. A plain LRU dict instead of
+# functools.lru_cache, so callers can check for a hit without classifying
+EXACT_INTENT_CACHE_SIZE = 4096
+_exact_intents = OrderedDict()
+_exact_intents_lock = threading.Lock()
+
+def cached_intent(normalized_message):
+    """Return the intent cached for this exact normalized message, or None"""
+    with _exact_intents_lock:
+        intent_type = _exact_intents.get(normalized_message)
+        if intent_type is not None:
+            _exact_intents.move_to_end(normalized_message)
+        return intent_type
+
+def _cache_intent(normalized_message, intent_type):
+    """Store an intent, evicting the least recently used entry when full"""
+    with _exact_intents_lock:
+        _exact_intents[normalized_message] = intent_type
+        _exact_intents.move_to_end(normalized_message)
+        if len(_exact_intents) > EXACT_INTENT_CACHE_SIZE:
+            _exact_intents.popitem(last=False)
+
+def _classify_intent_with_llm(normalized_message):
+    """
+    Classify a normalized message with the LLM.
+    Results are cached per normalized message; failures raise and are not cached.
+    """
+    intent_type = cached_intent(normalized_message)
+    if intent_type is not None:
+        return intent_type
+    
+    # Paraphrases of earlier messages are served from the semantic cache (when the
+    # local embedding model is installed)
+    embedding = None
+    if semantic_intent_cache.enabled:
+        try:
+            embedding = semantic_intent_cache.embed(normalized_message)
+        except Exception as e:
+            logger.warning(f"IntentAgent: Could not embed message for semantic cache: {str(e)}")
+    
+    if embedding is not None:
+        intent_type = semantic_intent_cache.lookup(embedding)
+        if intent_type is not None:
+            _cache_intent(normalized_message, intent_type)
+            return intent_type
+    
+    intent_type = intent_batcher.classify(normalized_message)
+    if intent_type:
+        _cache_intent(normalized_message, intent_type)
+        if embedding is not None:
+            semantic_intent_cache.add(embedding, intent_type)
+    
+    return intent_type
+
 class IntentAgent:
     """
     Class for classifying the intent of user messages.
@@ -28,82 +323,55 @@ class IntentAgent:
             tuple: (intent_type, intent_details)
                 intent_type: str - The type of intent (e.g., "reminder", "general")
         """
-        # Log the incoming message (truncated for privacy/brevity)
-        truncated_message = message[:50] + "..." if len(message) > 50 else message
-        logger.info(f"IntentAgent:Detecting intent for message: '{truncated_message}'")
+        # Log the incoming message (truncated for privacy/brevity); skip the slicing when INFO is off
+        if logger.isEnabledFor(logging.INFO):
+            truncated_message = message[:50] + "..." if len(message) > 50 else message
+            logger.info("IntentAgent:Detecting intent for message: %r", truncated_message)
+        
+        # Normalize once (casefold + collapsed whitespace) for the fast path and the cache key
+        normalized_message = " ".join(message.casefold().split())
+        
+        local_result = self._detect_intent_locally(normalized_message)
+        if local_result is not None:
+            logger.info("IntentAgent: Settled without the LLM: %r", local_result)
+            return local_result
         
         try:
-            logger.info(f"IntentAgent: Detecting reminder intent with LLM for message: '{message[:50]}...' (truncated)")
-            
-            system_prompt = """
-            Você é um assistente especializado em detectar intenções relacionadas a lembretes em mensagens em português.
-            
-            Analise a mensagem do usuário e identifique se ela contém uma intenção relacionada a lembretes.
-            
-            Retorne um JSON com o seguinte formato:
-            {
-              "intent_type": "reminder" ou "general"
-            }
-            
-            Onde:
-            - "reminder": indica que a mensagem contém uma intenção relacionada a lembretes
-            - "general": indica que a mensagem NÂO contém uma intenção relacionada a lembretes
-            
-            Exemplos:
-            - "me lembra de pagar a conta amanhã" → {"intent_type": "reminder"}
-            - "meus lembretes" → {"intent_type": "reminder"}
-            - "cancelar lembrete 2" → {"intent_type": "reminder"}
-            - "lembrete" → {"intent_type": "reminder"}
-            - "como está o tempo hoje?" → {"intent_type": "general"}
-            - "quem descobriu o Brasil?" → {"intent_type": "general"}
-            - "o que comer para ser saudável?" → {"intent_type": "general"}
-            """
-            
-            start_time = time_module.time()
-            
-            # Use the new OpenAI API format
-            from openai import OpenAI
-            client = OpenAI()
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
-                temperature=0.1,
-                response_format={"type": "json_object"}
-            )
-            
-            elapsed_time = time_module.time() - start_time
-            
-            if not response.choices or not response.choices[0].message.content:
-                logger.error("IntentAgent: Failed to get response from LLM")
-                raise ValueError("IntentAgent: Failed to get response from LLM")
-            
-            response_text = response.choices[0].message.content
-            
-            # Parse the JSON response
-            try:
-                result = json.loads(response_text)
-            except json.JSONDecodeError:
-                logger.error("IntentAgent: Failed to parse LLM response as JSON")
-                raise ValueError("IntentAgent: Failed to parse LLM response as JSON")
-            
-            logger.info(f"IntentAgent: LLM intent detection result: {result} (took {elapsed_time:.2f}s)")
-            
-            intent_type = result.get("intent_type")
-            
+            intent_type = _classify_intent_with_llm(normalized_message)
             return intent_type, None  # Return both intent_type and intent_details (None for now)
             
         except Exception as e:
             logger.error(f"IntentAgent: Error in LLM intent detection: {str(e)}")
             raise Exception(f"IntentAgent: Error in LLM intent detection: {str(e)}")
+    
+    def needs_llm(self, message):
+        """Whether detect_intent will have to call the LLM for this message (no local rule or cached result)"""
+        normalized_message = " ".join(message.casefold().split())
+        return self._detect_intent_locally(normalized_message) is None and cached_intent(normalized_message) is None
+    
+    def _detect_intent_locally(self, normalized_message):
+        """Settle obvious cases without an LLM round-trip; returns None when the LLM is needed"""
+        for action, pattern in HIGH_CONFIDENCE_PATTERNS:
+            if pattern.search(normalized_message):
+                return "reminder", {"action": action}
+        
+        if NO_REMINDER_RE.search(normalized_message) and not REMINDER_HINT_RE.search(normalized_message):
+            return "general", None
+        
+        if (len(normalized_message) < MIN_CLASSIFIABLE_LENGTH
+                or len(normalized_message) > MAX_CLASSIFIABLE_LENGTH
+                or DIGITS_ONLY_RE.fullmatch(normalized_message)
+                or URL_ONLY_RE.fullmatch(normalized_message)):
+            # Too short/long, or only digits or a link
+            return "general", None
+        
+        return None
 
     def detect_intent_with_llm(self, message):
         """Detect intent using LLM"""
         try:
-            logger.info(f"IntentAgent: Detecting reminder intent with LLM for message: '{message[:20]}...' (truncated)")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("IntentAgent: Detecting reminder intent with LLM for message: %r (truncated)", message[:20])
             
             # Create the system prompt
             system_prompt = """
@@ -132,9 +400,7 @@ class IntentAgent:
             - "como está o tempo hoje?" → {"intent": "general", "confidence": 0.9}
             """
             
-            # Use the new OpenAI API format
-            from openai import OpenAI
-            client = OpenAI()
+            client = get_openai_client()
             
             response = client.chat.completions.create(
                 model="gpt-4o-mini",
@@ -150,9 +416,9 @@ class IntentAgent:
             response_text = response.choices[0].message.content
             
             # Parse the JSON response
-            result = json.loads(response_text)
+            result = orjson.loads(response_text)
             
-            logger.info(f"IntentAgent: LLM intent detection result: {result}")
+            logger.info("IntentAgent: LLM intent detection result: %s", result)
             return result
             
         except Exception as e:
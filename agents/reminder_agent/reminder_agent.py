@@ -3,28 +3,151 @@ Reminder agent implementation.
 This file contains the ReminderAgent class for handling reminder-related functionality.
 """
 import logging
+import re
 import threading
-import time
-import json
+import httpx
+import orjson
 import openai
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from postgrest.exceptions import APIError
 
 from agents.reminder_agent.reminder_db import (
-    list_reminders, create_reminder, cancel_reminder, 
-    get_pending_reminders, get_late_reminders,
-    format_reminder_list_by_time, format_created_reminders,
+    list_reminders, create_reminders, cancel_reminders, bulk_cancel_active,
+    claim_due_reminders, reactivate_reminders, get_next_reminder_time,
+    format_reminder_list_by_time, format_created_reminders, parse_scheduled_time,
     to_local_timezone, to_utc_timezone, format_datetime,
     BRAZIL_TIMEZONE
 )
+from utils.llm_utils import get_openai_client
 
 logger = logging.getLogger(__name__)
 
+# One prompt covers listing, cancelling and creating, so every reminder message
+# needs at most a single LLM call
+_REMINDER_SYSTEM_PROMPT = """
+Você é um assistente especializado em interpretar pedidos de lembretes em mensagens em português.
+
+Analise a mensagem do usuário e identifique a ação pedida:
+- "list": o usuário quer ver seus lembretes
+- "cancel": o usuário quer cancelar um ou mais lembretes
+- "create": o usuário quer criar um lembrete
+- "none": a mensagem não é um pedido de lembrete
+
+IMPORTANTE: Sua resposta DEVE ser um JSON válido com o seguinte formato exato:
+{
+  "action": "list" | "cancel" | "create" | "none",
+  "reminder_ids": [números],
+  "cancel_all": true/false,
+  "cancel_title": "título do lembrete",
+  "reminders": [{"reminder_text": "texto do lembrete", "reminder_time": "YYYY-MM-DD HH:MM"}]
+}
+
+Onde:
+- "reminder_ids": para "cancel", os números dos lembretes a serem cancelados, ou [] se não forem especificados
+- "cancel_all": para "cancel", true se o usuário quer cancelar todos os lembretes
+- "cancel_title": para "cancel", o título (ou parte dele) quando o usuário identifica o lembrete pelo nome em vez do número
+- "reminders": para "create", um item por lembrete pedido, com:
+  - "reminder_text": o texto do que deve ser lembrado
+  - "reminder_time": a data e hora no formato YYYY-MM-DD HH:MM
+
+Use [], false ou null nos campos que não se aplicam à ação.
+
+Exemplos:
+- "quais são meus lembretes?" → {"action": "list", "reminder_ids": [], "cancel_all": false, "cancel_title": null, "reminders": []}
+- "cancelar lembrete 2" → {"action": "cancel", "reminder_ids": [2], "cancel_all": false, "cancel_title": null, "reminders": []}
+- "remover lembretes 1 e 3" → {"action": "cancel", "reminder_ids": [1, 3], "cancel_all": false, "cancel_title": null, "reminders": []}
+- "apagar lembretes de 2 a 4" → {"action": "cancel", "reminder_ids": [2, 3, 4], "cancel_all": false, "cancel_title": null, "reminders": []}
+- "cancelar lembrete reunião" → {"action": "cancel", "reminder_ids": [], "cancel_all": false, "cancel_title": "reunião", "reminders": []}
+- "cancelar todos os lembretes" → {"action": "cancel", "reminder_ids": [], "cancel_all": true, "cancel_title": null, "reminders": []}
+- "me lembra de pagar a conta amanhã às 10h" → {"action": "create", "reminder_ids": [], "cancel_all": false, "cancel_title": null, "reminders": [{"reminder_text": "pagar a conta", "reminder_time": "2023-05-11 10:00"}]}
+- "me lembra da reunião dia 15/05 às 14h" → {"action": "create", "reminder_ids": [], "cancel_all": false, "cancel_title": null, "reminders": [{"reminder_text": "reunião", "reminder_time": "2023-05-15 14:00"}]}
+- "me lembra de tomar remédio às 8h e às 20h amanhã" → {"action": "create", "reminder_ids": [], "cancel_all": false, "cancel_title": null, "reminders": [{"reminder_text": "tomar remédio", "reminder_time": "2023-05-11 08:00"}, {"reminder_text": "tomar remédio", "reminder_time": "2023-05-11 20:00"}]}
+- "como está o tempo hoje?" → {"action": "none", "reminder_ids": [], "cancel_all": false, "cancel_title": null, "reminders": []}
+
+Hoje é {current_date}.
+""".strip()
+
+@lru_cache(maxsize=2)
+def _reminder_system_prompt(current_date):
+    """Return the reminder prompt for a date; rebuilt only when the date changes"""
+    # str.replace rather than str.format, which would trip over the JSON braces
+    return _REMINDER_SYSTEM_PROMPT.replace("{current_date}", current_date)
+
+@lru_cache(maxsize=1024)
+def _interpret_with_llm(message, current_date):
+    """
+    Interpret a reminder message with the LLM, cached per message and date.
+    Raises on failure so errors are never cached.
+    """
+    client = get_openai_client()
+    
+    response = client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": _reminder_system_prompt(current_date)},
+            {"role": "user", "content": message}
+        ],
+        temperature=0.1,
+        response_format={"type": "json_object"}
+    )
+    
+    return orjson.loads(response.choices[0].message.content.strip())
+
+# Common reminder phrasings resolved without the LLM, e.g.
+# "me lembra de pagar a conta daqui 10 minutos" or "me lembra de ligar pro João amanhã às 15h"
+_SIMPLE_REMINDER_RE = re.compile(
+    r'^(?:me lembr[ae]|lembre-me)\s+(?:de\s+)?(?P<text>.+?)\s+'
+    r'(?:daqui\s+(?:a\s+)?(?P<amount>\d+)\s+(?P<unit>minutos?|horas?|dias?)'
+    r'|amanhã(?:\s+às\s+(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*h?)?)[.!]?$',
+    re.IGNORECASE
+)
+_RELATIVE_UNITS = {'minuto': 'minutes', 'hora': 'hours', 'dia': 'days'}
+
+# Time used when a reminder names a day but no time
+DEFAULT_REMINDER_HOUR = 9
+
+def _parse_simple_reminder(message, now):
+    """Return a create request for the common phrasings above, or None to fall back to the LLM"""
+    match = _SIMPLE_REMINDER_RE.match(message)
+    if not match:
+        return None
+    
+    if match.group('amount'):
+        unit = _RELATIVE_UNITS[match.group('unit').casefold().rstrip('s')]
+        reminder_time = now + timedelta(**{unit: int(match.group('amount'))})
+    else:
+        hour = int(match.group('hour') or DEFAULT_REMINDER_HOUR)
+        minute = int(match.group('minute') or 0)
+        if hour > 23 or minute > 59:
+            return None
+        reminder_time = (now + timedelta(days=1)).replace(hour=hour, minute=minute)
+    
+    return {
+        "action": "create",
+        "reminders": [{
+            "reminder_text": match.group('text'),
+            "reminder_time": reminder_time.strftime("%Y-%m-%d %H:%M")
+        }]
+    }
+
+# Due reminders older than this are sent with a late notice
+LATE_THRESHOLD_MINUTES = 30
+
+# Counters reported by check_and_send_reminders when nothing was processed
+_EMPTY_CHECK_RESULT = {
+    "pending_count": 0,
+    "late_count": 0,
+    "sent_count": 0,
+    "total_processed": 0
+}
+
 # Add this function to replace parse_json_response
 def parse_json_response(response_text):
     """Parse a JSON response from the LLM"""
     try:
-        return json.loads(response_text)
-    except json.JSONDecodeError as e:
+        return orjson.loads(response_text)
+    except orjson.JSONDecodeError as e:
         logger.error(f"Failed to parse JSON response: {str(e)}")
         return None
 
@@ -36,225 +159,66 @@ class ReminderAgent:
         self.send_message_func = send_message_func
         self.check_interval = check_interval
         self.stop_event = threading.Event()
+        # Set to wake the checker early, e.g. when a new reminder is created
+        self.wake_event = threading.Event()
+        # Serializes sweeps from the checker thread and the HTTP endpoint
+        self.check_lock = threading.Lock()
+        self.checker_thread = None
     
-    def extract_reminder_details(self, message):
+    def interpret_reminder_request(self, message):
         """
-        Extract reminder details from a message using LLM.
+        Interpret a reminder message (list, cancel or create) with at most one LLM call.
         """
         try:
-            logger.info(f"Extracting reminder details from message: '{message[:50]}...' (truncated)")
-            
-            # Try a different approach with a more explicit system prompt
-            system_prompt = """
-            Você é um assistente especializado em extrair detalhes de lembretes de mensagens em português.
-            
-            Analise a mensagem do usuário e extraia as seguintes informações:
-            1. O que deve ser lembrado (texto)
-            2. Quando o lembrete deve ser enviado (data e hora)
-            
-            IMPORTANTE: Sua resposta DEVE ser um JSON válido com o seguinte formato exato:
-            {
-              "reminder_text": "texto do lembrete",
-              "reminder_time": "YYYY-MM-DD HH:MM" 
-            }
-            
-            Onde:
-            - "reminder_text": o texto do que deve ser lembrado
-            - "reminder_time": a data e hora no formato YYYY-MM-DD HH:MM
-            
-            Se não conseguir extrair alguma informação, retorne null para o campo correspondente.
-            
-            Exemplos:
-            - "me lembra de pagar a conta amanhã às 10h" → {"reminder_text": "pagar a conta", "reminder_time": "2023-05-11 10:00"}
-            - "me lembra da reunião dia 15/05 às 14h" → {"reminder_text": "reunião", "reminder_time": "2023-05-15 14:00"}
-            - "lembrete para ligar para o médico na segunda" → {"reminder_text": "ligar para o médico", "reminder_time": "2023-05-15 09:00"}
-            - "como está o tempo hoje?" → {"reminder_text": null, "reminder_time": null} 
-            
-            Hoje é {current_date}.
-            """
+            logger.info(f"Interpreting reminder request from message: '{message[:50]}...' (truncated)")
             
-            # Format the current date
-            current_date = datetime.now(BRAZIL_TIMEZONE).strftime("%Y-%m-%d")
-            system_prompt = system_prompt.format(current_date=current_date)
+            # Whitespace-normalized once; it is also the LLM cache key, so spacing
+            # differences don't miss the cache (case is kept for reminder titles)
+            message = " ".join(message.split())
+            now = datetime.now(BRAZIL_TIMEZONE)
+            result = _parse_simple_reminder(message, now)
+            if result is None:
+                result = _interpret_with_llm(message, now.strftime("%Y-%m-%d"))
             
-            # Use the new OpenAI API format with a more reliable model
-            from openai import OpenAI
-            client = OpenAI()
+            logger.info(f"Interpreted reminder request: {result}")
+            return result
             
-            # First attempt with gpt-4o-mini
-            logger.info(f"Sending request to OpenAI with message: '{message[:50]}...'")
-            logger.info(f"Using model: gpt-4o-mini")
-            
-            try:
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": message}
-                    ],
-                    temperature=0.1,
-                    response_format={"type": "json_object"}
-                )
-                
-                logger.info(f"Raw response from OpenAI: {response}")
-                # Get the response content
-                response_text = response.choices[0].message.content.strip()
-                logger.info(f"Response from OpenAI converted to text: {response_text}")
-                
-                # Try to parse the JSON
-                result = json.loads(response_text)
-                logger.info(f"Extracted reminder details: {result}")
-                return result
-            except openai.APIError as api_err:
-                logger.error(f"OpenAI API error: {str(api_err)}")
-                return None
-            except openai.APIConnectionError as conn_err:
-                logger.error(f"OpenAI API connection error: {str(conn_err)}")
-                return None
-            except openai.RateLimitError as rate_err:
-                logger.error(f"OpenAI API rate limit exceeded: {str(rate_err)}")
-                return None
-            except Exception as e:
-                logger.error(f"Unexpected error in OpenAI API call: {str(e)}")
-                logger.error(f"Error type: {type(e).__name__}")
-                return None
-            
-        except Exception as e:
-            logger.error(f"Error extracting reminder details: {str(e)}")
-            logger.error(f"Error type: {type(e).__name__}")
+        except orjson.JSONDecodeError as e:
+            logger.error(f"Failed to parse JSON response: {str(e)}")
             return None
-    
-    def extract_reminder_cancellation(self, message):
-        """
-        Extract reminder cancellation details from a message using LLM.
-        """
-        try:
-            logger.info(f"Extracting reminder cancellation from message: '{message[:50]}...' (truncated)")
-            
-            system_prompt = """
-            Você é um assistente especializado em extrair detalhes de cancelamento de lembretes de mensagens em português.
-            
-            Analise a mensagem do usuário e determine se ele está tentando cancelar um lembrete.
-            Se sim, extraia o número ou identificador do lembrete a ser cancelado.
-            
-            Retorne um JSON com o seguinte formato:
-            {
-              "is_cancellation": true/false,
-              "reminder_id": número ou null
-            }
-            
-            Onde:
-            - "is_cancellation": true se a mensagem é um pedido de cancelamento, false caso contrário
-            - "reminder_id": o número/id do lembrete a ser cancelado, ou null se não for especificado
-            
-            Exemplos:
-            - "cancelar lembrete 2" → {"is_cancellation": true, "reminder_id": 2}
-            - "remover lembrete número 5" → {"is_cancellation": true, "reminder_id": 5}
-            - "apagar o lembrete 1" → {"is_cancellation": true, "reminder_id": 1}
-            - "cancelar todos os lembretes" → {"is_cancellation": true, "reminder_id": null}
-            - "como está o tempo hoje?" → {"is_cancellation": false, "reminder_id": null}
-            """
-            
-            # Use the new OpenAI API format
-            from openai import OpenAI
-            client = OpenAI()
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
-                temperature=0.1,
-                response_format={"type": "json_object"}
-            )
-            
-            # Get the response content
-            response_text = response.choices[0].message.content.strip()
-            
-            # Add better error handling for JSON parsing
-            try:
-                result = json.loads(response_text)
-                logger.info(f"Extracted reminder cancellation details: {result}")
-                return result
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse JSON response: {str(e)}")
-                logger.error(f"Raw response: {response_text}")
-                return None
-            
-        except Exception as e:
-            logger.error(f"Error extracting reminder cancellation: {str(e)}")
+        except openai.OpenAIError as e:
+            logger.error(f"OpenAI API error: {str(e)}")
             return None
-    
-    def detect_reminder_list_request(self, message):
-        """
-        Detect if a message is requesting to list reminders.
-        """
-        try:
-            logger.info(f"Detecting reminder list request from message: '{message[:50]}...' (truncated)")
-            
-            system_prompt = """
-            Você é um assistente especializado em detectar pedidos de listagem de lembretes em mensagens em português.
-            
-            Analise a mensagem do usuário e determine se ele está pedindo para listar seus lembretes.
-            
-            Retorne um JSON com o seguinte formato:
-            {
-              "is_list_request": true/false
-            }
-            
-            Onde:
-            - "is_list_request": true se a mensagem é um pedido de listagem de lembretes, false caso contrário
-            
-            Exemplos:
-            - "listar lembretes" → {"is_list_request": true}
-            - "quais são meus lembretes?" → {"is_list_request": true}
-            - "mostre meus lembretes" → {"is_list_request": true}
-            - "lembretes" → {"is_list_request": true}
-            - "como está o tempo hoje?" → {"is_list_request": false}
-            """
-            
-            # Use the new OpenAI API format
-            from openai import OpenAI
-            client = OpenAI()
-            
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
-                temperature=0.1,
-                response_format={"type": "json_object"}
-            )
-            
-            # Get the response content
-            response_text = response.choices[0].message.content.strip()
-            
-            # Add better error handling for JSON parsing
-            try:
-                result = json.loads(response_text)
-                logger.info(f"Detected reminder list request: {result}")
-                return result
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse JSON response: {str(e)}")
-                logger.error(f"Raw response: {response_text}")
-                return None
-            
         except Exception as e:
-            logger.error(f"Error detecting reminder list request: {str(e)}")
+            logger.error(f"Error interpreting reminder request: {str(e)}")
+            logger.error(f"Error type: {type(e).__name__}")
             return None
     
     # Add any other methods that might use llm_utils here
     
-    def handle_reminder_intent(self, from_number, message):
+    def handle_reminder_intent(self, from_number, message, intent_details=None):
         """
         Handle a reminder intent from a user message.
+        intent_details may carry the action already matched by the IntentAgent fast path.
         """
         try:
-            # First check if it's a request to list reminders
-            list_request = self.detect_reminder_list_request(message)
-            if list_request and list_request.get('is_list_request', False):
+            # A keyword match in the IntentAgent settles "list" without any LLM call;
+            # everything else is interpreted by a single combined LLM call
+            fast_action = (intent_details or {}).get('action')
+            reminders = None
+            if fast_action == 'cancel':
+                # Users with nothing to cancel get an answer without the LLM call
+                reminders = list_reminders(from_number)
+                if not reminders:
+                    return "Você não tem nenhum lembrete para cancelar."
+            
+            if fast_action == 'list':
+                request = {'action': 'list'}
+            else:
+                request = self.interpret_reminder_request(message) or {}
+            action = request.get('action')
+
+            if action == 'list':
                 # List reminders
                 reminders = list_reminders(from_number)
                 if not reminders:
@@ -263,49 +227,109 @@ class ReminderAgent:
                 formatted_list = format_reminder_list_by_time(reminders)
                 return f"Seus lembretes:\n\n{formatted_list}"
             
-            # Then check if it's a cancellation request
-            cancel_request = self.extract_reminder_cancellation(message)
-            if cancel_request and cancel_request.get('is_cancellation', False):
-                reminder_id = cancel_request.get('reminder_id')
-                if reminder_id is not None:
-                    # Cancel a specific reminder
-                    result = cancel_reminder(from_number, reminder_id)
-                    if result:
-                        return f"Lembrete {reminder_id} cancelado com sucesso."
-                    else:
-                        return f"Não encontrei um lembrete com o número {reminder_id}."
-                else:
-                    # User wants to cancel but didn't specify which one
+            if action == 'cancel' and request.get('cancel_all'):
+                # One update cancels everything; no need to list the reminders first
+                cancelled_count = bulk_cancel_active(from_number)
+                if cancelled_count is None:
+                    return "Não consegui cancelar os lembretes. Por favor, tente novamente."
+                if not cancelled_count:
+                    return "Você não tem nenhum lembrete para cancelar."
+                return "Todos os seus lembretes foram cancelados."
+            
+            if action == 'cancel':
+                # Fetch the active reminders once (unless already fetched above); the number
+                # given by the user is the position shown in the list, ordered by scheduled_time
+                if reminders is None:
                     reminders = list_reminders(from_number)
-                    if not reminders:
-                        return "Você não tem nenhum lembrete para cancelar."
-                    
+                if not reminders:
+                    return "Você não tem nenhum lembrete para cancelar."
+
+                # Resolve every requested number before touching the database
+                cancelled_ids = set()
+                for number in request.get('reminder_ids') or []:
+                    try:
+                        position = int(number)
+                    except (TypeError, ValueError):
+                        position = 0
+                    if position < 1 or position > len(reminders):
+                        return f"Não encontrei um lembrete com o número {number}."
+                    cancelled_ids.add(reminders[position - 1]['id'])
+                
+                cancel_title = request.get('cancel_title')
+                if not cancelled_ids and cancel_title:
+                    # Every reminder whose title contains the given name
+                    wanted = cancel_title.casefold()
+                    cancelled_ids = {r['id'] for r in reminders if wanted in r['title'].casefold()}
+                    if not cancelled_ids:
+                        return f"Não encontrei nenhum lembrete com o título '{cancel_title}'."
+                
+                if not cancelled_ids:
+                    # User wants to cancel but didn't specify which one
                     formatted_list = format_reminder_list_by_time(reminders)
                     return f"Qual lembrete você deseja cancelar? Por favor, especifique o número:\n\n{formatted_list}"
-            
-            # Finally, try to extract reminder details for creation
-            reminder_details = self.extract_reminder_details(message)
-            if reminder_details:
-                reminder_text = reminder_details.get('reminder_text')
-                reminder_time_str = reminder_details.get('reminder_time')
                 
-                if not reminder_text or not reminder_time_str:
-                    return "Não consegui entender todos os detalhes do lembrete. Por favor, especifique o que devo lembrar e quando."
+                # Cancel them all in a single update
+                if not cancel_reminders(cancelled_ids):
+                    return "Não consegui cancelar os lembretes. Por favor, tente novamente."
                 
-                try:
-                    # Parse the datetime
-                    reminder_time = datetime.strptime(reminder_time_str, "%Y-%m-%d %H:%M")
-                    reminder_time = BRAZIL_TIMEZONE.localize(reminder_time)
-                    
-                    # Create the reminder
-                    reminder_id = create_reminder(from_number, reminder_text, reminder_time)
+                if len(cancelled_ids) == 1 and request.get('reminder_ids'):
+                    response = f"Lembrete {request['reminder_ids'][0]} cancelado com sucesso."
+                elif len(cancelled_ids) == 1:
+                    response = f"Lembrete '{cancel_title}' cancelado com sucesso."
+                else:
+                    response = f"{len(cancelled_ids)} lembretes cancelados com sucesso."
+                
+                # Compute the remaining reminders locally instead of querying again
+                remaining_reminders = [r for r in reminders if r['id'] not in cancelled_ids]
+                if remaining_reminders:
+                    response += f"\n\n{format_reminder_list_by_time(remaining_reminders)}"
+                return response
+            
+            if action == 'create':
+                # Validate every requested reminder first, then insert them all at once
+                now_local = datetime.now(BRAZIL_TIMEZONE).replace(tzinfo=None)
+                rows = []
+                # Rejected items are tallied by reason in the same pass
+                past_count = 0
+                unparsed_count = 0
+                for item in request.get('reminders') or []:
+                    reminder_text = item.get('reminder_text')
+                    reminder_time_str = item.get('reminder_time')
+                    if not reminder_text or not reminder_time_str:
+                        unparsed_count += 1
+                        continue
                     
-                    # Format the confirmation message
-                    local_time = format_datetime(reminder_time)
-                    return f"Lembrete criado com sucesso! Vou te lembrar de '{reminder_text}' em {local_time}."
+                    try:
+                        reminder_time = datetime.strptime(reminder_time_str, "%Y-%m-%d %H:%M")
+                    except ValueError:
+                        unparsed_count += 1
+                        continue
                     
-                except ValueError:
-                    return "Não consegui entender a data e hora do lembrete. Por favor, tente novamente com um formato como 'amanhã às 10h' ou '15/05 às 14h'."
+                    # Reject past times with a plain naive comparison against local wall
+                    # time, before attaching the timezone
+                    if reminder_time <= now_local:
+                        past_count += 1
+                        continue
+                    rows.append({'title': reminder_text, 'time': reminder_time.replace(tzinfo=BRAZIL_TIMEZONE)})
+                
+                if not rows:
+                    if past_count and not unparsed_count:
+                        return "Esse horário já passou. Por favor, tente novamente com um horário futuro, como 'amanhã às 10h' ou '15/05 às 14h'."
+                    if past_count or unparsed_count:
+                        return "Não consegui entender a data e hora do lembrete, ou esse horário já passou. Por favor, tente novamente com um horário futuro, como 'amanhã às 10h' ou '15/05 às 14h'."
+                    return "Não consegui entender todos os detalhes do lembrete. Por favor, especifique o que devo lembrar e quando."
+                
+                created_reminders = create_reminders(from_number, rows)
+                if created_reminders:
+                    # Let the checker recompute when it should wake up next
+                    self.wake_event.set()
+                
+                response = format_created_reminders(created_reminders)
+                if created_reminders and past_count:
+                    response += f"\n\n⚠️ {past_count} lembrete(s) não foram criados porque o horário já passou."
+                if created_reminders and unparsed_count:
+                    response += f"\n\n⚠️ {unparsed_count} lembrete(s) não foram criados porque o horário não foi entendido."
+                return response
             
             # If we got here, we couldn't handle the reminder intent
             return "Não consegui entender seu pedido de lembrete. Por favor, tente novamente com algo como 'me lembra de pagar a conta amanhã às 10h'."
@@ -318,39 +342,73 @@ class ReminderAgent:
         """
         Check for pending reminders and send them.
         """
+        # Skip if another sweep (background thread or HTTP trigger) is already running
+        if not self.check_lock.acquire(blocking=False):
+            logger.info("Reminder check already in progress, skipping")
+            return {**_EMPTY_CHECK_RESULT, "status": "skipped", "reason": "check already in progress"}
+        
         try:
             logger.info("Checking for pending reminders")
             
-            # Get pending reminders (due now)
-            pending_reminders = get_pending_reminders()
-            
-            # Get late reminders (missed while the service was down)
-            late_reminders = get_late_reminders()
+            # Claim every due reminder in one round-trip. The claim already marks them
+            # inactive, so concurrent checkers (other workers, the HTTP trigger) never
+            # receive the same reminder. The trade-off is at-most-once delivery: a
+            # reminder is inactive before its message is sent, and only queue-full
+            # rejections (below) and dropped messages (handle_dropped_message) bring it back
+            due_reminders = claim_due_reminders()
+            
+            # Reminders overdue by more than the threshold were missed (e.g. while the
+            # service was down) and are sent with a late notice
+            now_truncated = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+            late_threshold = now_truncated - timedelta(minutes=LATE_THRESHOLD_MINUTES)
+            pending_reminders = []
+            late_reminders = []
+            for reminder in due_reminders:
+                scheduled_time = parse_scheduled_time(reminder).replace(second=0, microsecond=0)
+                if scheduled_time <= late_threshold:
+                    late_reminders.append(reminder)
+                else:
+                    pending_reminders.append(reminder)
             
             total_reminders = len(pending_reminders) + len(late_reminders)
             logger.info(f"Found {len(pending_reminders)} pending and {len(late_reminders)} late reminders")
             
+            sent_count = 0
+            failed_ids = []
+            
             # Process pending reminders
             for reminder in pending_reminders:
-                self._send_reminder(reminder, is_late=False)
+                if self._send_reminder(reminder, is_late=False):
+                    sent_count += 1
+                else:
+                    failed_ids.append(reminder['id'])
             
             # Process late reminders
             for reminder in late_reminders:
-                self._send_reminder(reminder, is_late=True)
+                if self._send_reminder(reminder, is_late=True):
+                    sent_count += 1
+                else:
+                    failed_ids.append(reminder['id'])
+            
+            # Hand reminders that could not be sent back to the next sweep
+            if failed_ids and reactivate_reminders(failed_ids):
+                logger.info(f"Reactivated {len(failed_ids)} reminders that failed to send: {failed_ids}")
             
             return {
                 "status": "success",
                 "pending_count": len(pending_reminders),
                 "late_count": len(late_reminders),
+                "sent_count": sent_count,
                 "total_processed": total_reminders
             }
             
-        except Exception as e:
+        except (APIError, httpx.HTTPError) as e:
+            # Only Supabase/network failures are reported back; programming errors
+            # propagate so they show up with a full traceback
             logger.error(f"Error checking reminders: {str(e)}")
-            return {
-                "status": "error",
-                "error": str(e)
-            }
+            return {**_EMPTY_CHECK_RESULT, "status": "error", "error": str(e)}
+        finally:
+            self.check_lock.release()
     
     def _send_reminder(self, reminder, is_late=False):
         """
@@ -361,9 +419,9 @@ class ReminderAgent:
                 logger.error("No send_message_func provided to ReminderAgent")
                 return False
             
-            user_number = reminder['user_number']
-            reminder_text = reminder['reminder_text']
-            reminder_time = reminder['reminder_time']
+            user_number = reminder['user_phone']
+            reminder_text = reminder['title']
+            reminder_time = parse_scheduled_time(reminder)
             reminder_id = reminder['id']
             
             # Format the reminder message
@@ -374,13 +432,17 @@ class ReminderAgent:
             else:
                 message = f"⏰ LEMBRETE ⏰\n\n{reminder_text}"
             
-            # Send the message
-            self.send_message_func(user_number, message)
+            # Send the message; a full outbound queue counts as a failure so the
+            # reminder is reactivated instead of lost. The reminder id travels with the
+            # queued message so handle_dropped_message can reactivate it if Twilio
+            # keeps failing
+            if not self.send_message_func(user_number, message, context={'reminder_id': reminder_id}):
+                logger.error(f"Could not queue reminder {reminder_id} for {user_number}")
+                return False
             
-            # Mark the reminder as sent in the database
-            # This would typically update a 'sent' flag in your database
-            # For now, we'll just log it
-            logger.info(f"Sent reminder {reminder_id} to {user_number}")
+            # The reminder was already deactivated when it was claimed; from here on it
+            # is only in the outbound queue (see handle_dropped_message)
+            logger.info(f"Queued reminder {reminder_id} for {user_number}")
             
             return True
             
@@ -388,6 +450,25 @@ class ReminderAgent:
             logger.error(f"Error sending reminder: {str(e)}")
             return False
     
+    def handle_dropped_message(self, message_data):
+        """
+        Reactivate the reminder of an outbound message given up on after repeated
+        transient failures, so the next sweep sends it again (as a late reminder).
+        Delivery is otherwise at-most-once: a claimed reminder that is still in the
+        in-memory outbound queue when the process stops is lost (with REDIS_URL set
+        the queue survives restarts). Messages rejected by Twilio for good (e.g. an
+        invalid number) are not retried.
+        """
+        reminder_id = (message_data.get('context') or {}).get('reminder_id')
+        if reminder_id is None:
+            return
+        
+        try:
+            reactivate_reminders([reminder_id])
+            logger.info(f"Reactivated reminder {reminder_id} after its message was dropped")
+        except (APIError, httpx.HTTPError) as e:
+            logger.error(f"Could not reactivate reminder {reminder_id}: {str(e)}")
+    
     def _check_reminders_loop(self):
         """
         Background thread function to periodically check for reminders.
@@ -400,25 +481,49 @@ class ReminderAgent:
             except Exception as e:
                 logger.error(f"Error in reminder checker loop: {str(e)}")
             
-            # Sleep for the check interval, but check the stop event periodically
-            for _ in range(self.check_interval):
-                if self.stop_event.is_set():
-                    break
-                time.sleep(1)
+            # Sleep until the next reminder is due (capped at the check interval,
+            # which still catches reminders created by other processes), or until
+            # woken up by a new reminder or a stop request
+            self.wake_event.wait(timeout=self._seconds_until_next_check())
+            self.wake_event.clear()
+    
+    def _seconds_until_next_check(self):
+        """
+        Compute how long the checker can sleep before the next reminder is due.
+        """
+        try:
+            next_time = get_next_reminder_time()
+        except (APIError, httpx.HTTPError):
+            # Already logged; fall back to the regular interval
+            return self.check_interval
+        if next_time is None:
+            return self.check_interval
+        
+        # Reminders are due at the start of their scheduled minute
+        now = datetime.now(timezone.utc)
+        due_at = next_time.replace(second=0, microsecond=0)
+        delay = (due_at - now).total_seconds()
+        return min(self.check_interval, max(1, delay))
     
     def start_reminder_checker(self):
         """
         Start the background thread for checking reminders.
+        Does nothing if the thread is already running.
         """
+        if self.checker_thread is not None and self.checker_thread.is_alive():
+            return self.checker_thread
+        
         self.stop_event.clear()
-        checker_thread = threading.Thread(target=self._check_reminders_loop, daemon=True)
-        checker_thread.start()
+        self.wake_event.clear()
+        self.checker_thread = threading.Thread(target=self._check_reminders_loop, daemon=True)
+        self.checker_thread.start()
         logger.info("Reminder checker thread started")
-        return checker_thread
+        return self.checker_thread
     
     def stop_reminder_checker(self):
         """
         Stop the background thread for checking reminders.
         """
         self.stop_event.set()
+        self.wake_event.set()
         logger.info("Reminder checker thread stopping")
\ No newline at end of file
@@ -4,12 +4,22 @@ This file contains functions for managing reminders in the database.
 """
 import logging
 from datetime import datetime, timezone, timedelta
+import httpx
 import pytz
+from postgrest.exceptions import APIError
 from utils.database import supabase
-from utils.datetime_utils import to_local_timezone, to_utc_timezone, format_datetime, BRAZIL_TIMEZONE
+from utils.datetime_utils import to_local_timezone, to_utc_timezone, format_datetime, parse_iso_datetime, BRAZIL_TIMEZONE
 
 logger = logging.getLogger(__name__)
 
+def parse_scheduled_time(reminder):
+    """Returns a reminder's scheduled_time as a datetime, parsing it only once per reminder"""
+    scheduled_time = reminder.get('_scheduled_dt')
+    if scheduled_time is None:
+        scheduled_time = parse_iso_datetime(reminder['scheduled_time'])
+        reminder['_scheduled_dt'] = scheduled_time
+    return scheduled_time
+
 def list_reminders(user_phone):
     """Lists active reminders for a user"""
     try:
@@ -51,6 +61,40 @@ def create_reminder(user_phone, title, scheduled_time):
         logger.error(f"Error creating reminder: {str(e)}")
         return None
 
+def create_reminders(user_phone, reminders):
+    """
+    Creates several reminders in a single insert.
+    reminders is a list of {'title', 'time'} dicts; returns the ones created, with their ids.
+    """
+    try:
+        logger.info(f"Creating {len(reminders)} reminders for user {user_phone}")
+        rows = [
+            {
+                'user_phone': user_phone,
+                'title': reminder['title'],
+                'scheduled_time': reminder['time'].isoformat(),
+                'is_active': True
+            }
+            for reminder in reminders
+        ]
+        
+        result = supabase.table('reminders').insert(rows).execute()
+        
+        if not result.data:
+            logger.error("Failed to create reminders: No data returned")
+            return []
+        
+        # PostgREST returns the inserted rows in the order they were sent
+        created = [
+            {'id': row['id'], 'title': reminder['title'], 'time': reminder['time']}
+            for row, reminder in zip(result.data, reminders)
+        ]
+        logger.info(f"Created reminders {[r['id'] for r in created]} for user {user_phone}")
+        return created
+    except Exception as e:
+        logger.error(f"Error creating reminders: {str(e)}")
+        return []
+
 def cancel_reminder(reminder_id):
     """Cancels a reminder by setting is_active to False"""
     try:
@@ -65,75 +109,89 @@ def cancel_reminder(reminder_id):
         logger.error(f"Error cancelling reminder {reminder_id}: {str(e)}")
         return False
 
-def get_pending_reminders():
-    """Gets all pending reminders that should be sent now"""
+def cancel_reminders(reminder_ids):
+    """Cancels several reminders in a single update, returning how many were cancelled"""
     try:
-        # Get current time in UTC
-        now = datetime.now(timezone.utc)
-        # Truncate seconds for comparison
-        now_truncated = now.replace(second=0, microsecond=0)
+        logger.info(f"Cancelling {len(reminder_ids)} reminders")
+        result = supabase.table('reminders') \
+            .update({'is_active': False}) \
+            .in_('id', list(reminder_ids)) \
+            .execute()
         
-        # Get all active reminders
+        return len(result.data or [])
+    except Exception as e:
+        logger.error(f"Error cancelling reminders {reminder_ids}: {str(e)}")
+        return 0
+
+def bulk_cancel_active(user_phone):
+    """Cancels all active reminders of a user in a single update, returning how many were cancelled"""
+    try:
+        logger.info(f"Cancelling all active reminders for user {user_phone}")
         result = supabase.table('reminders') \
-            .select('*') \
+            .update({'is_active': False}) \
+            .eq('user_phone', user_phone) \
             .eq('is_active', True) \
             .execute()
         
-        reminders = result.data
-        logger.info(f"Found {len(reminders)} active reminders")
+        return len(result.data or [])
+    except Exception as e:
+        logger.error(f"Error cancelling reminders for user {user_phone}: {str(e)}")
+        return None
+
+def reactivate_reminders(reminder_ids):
+    """Sets is_active back to True for several reminders in a single update; Supabase errors are raised"""
+    try:
+        logger.info(f"Reactivating {len(reminder_ids)} reminders")
+        supabase.table('reminders') \
+            .update({'is_active': True}) \
+            .in_('id', list(reminder_ids)) \
+            .execute()
         
-        # Filter reminders manually to ignore seconds
-        pending_reminders = []
-        for reminder in reminders:
-            scheduled_time = datetime.fromisoformat(reminder['scheduled_time'].replace('Z', '+00:00'))
-            # Truncate seconds for comparison
-            scheduled_time_truncated = scheduled_time.replace(second=0, microsecond=0)
-            
-            # Only include reminders that are due (current time >= scheduled time)
-            if now_truncated >= scheduled_time_truncated:
-                pending_reminders.append(reminder)
+        return True
+    except (APIError, httpx.HTTPError) as e:
+        logger.error(f"Error reactivating reminders {reminder_ids}: {str(e)}")
+        raise
+
+def claim_due_reminders(limit=100):
+    """
+    Claims due reminders for sending in a single round-trip.
+    The claim_due_reminders Postgres function (supabase/migrations) marks them
+    inactive and returns them atomically, skipping rows locked by another checker.
+    Supabase and network errors are raised, so the sweep reports them instead of
+    looking like a sweep with nothing due.
+    """
+    try:
+        result = supabase.rpc('claim_due_reminders', {'n': limit}).execute()
         
-        logger.info(f"Found {len(pending_reminders)} pending reminders after time comparison")
-        return pending_reminders
-    except Exception as e:
-        logger.error(f"Error getting pending reminders: {str(e)}")
-        return []
+        reminders = result.data or []
+        logger.info(f"Claimed {len(reminders)} due reminders")
+        return reminders
+    except (APIError, httpx.HTTPError) as e:
+        logger.error(f"Error claiming due reminders: {str(e)}")
+        raise
 
-def get_late_reminders(minutes_threshold=30):
-    """Gets reminders that are late by the specified threshold"""
+def get_next_reminder_time():
+    """Gets the scheduled time of the earliest active reminder not yet due; Supabase errors are raised"""
     try:
-        # Get current time in UTC
+        # Reminders in the current minute are already due, so start at the next one
         now = datetime.now(timezone.utc)
-        # Truncate seconds
-        now_truncated = now.replace(second=0, microsecond=0)
-        
-        # Define late threshold
-        late_threshold = now_truncated - timedelta(minutes=minutes_threshold)
+        next_minute = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
         
-        # Get all active reminders
         result = supabase.table('reminders') \
-            .select('*') \
+            .select('scheduled_time') \
             .eq('is_active', True) \
+            .gte('scheduled_time', next_minute.isoformat()) \
+            .order('scheduled_time') \
+            .limit(1) \
             .execute()
         
-        reminders = result.data
-        
-        # Filter late reminders manually
-        late_reminders = []
-        for reminder in reminders:
-            scheduled_time = datetime.fromisoformat(reminder['scheduled_time'].replace('Z', '+00:00'))
-            # Truncate seconds
-            scheduled_time_truncated = scheduled_time.replace(second=0, microsecond=0)
-            if scheduled_time_truncated <= late_threshold:
-                late_reminders.append(reminder)
-        
-        if late_reminders:
-            logger.info(f"Found {len(late_reminders)} late reminders")
+        if not result.data:
+            return None
         
-        return late_reminders
-    except Exception as e:
-        logger.error(f"Error getting late reminders: {str(e)}")
-        return []
+        return parse_iso_datetime(result.data[0]['scheduled_time'])
+    except (APIError, httpx.HTTPError) as e:
+        logger.error(f"Error getting next reminder time: {str(e)}")
+        raise
 
 def format_reminder_list_by_time(reminders, include_cancel_instructions=True):
     """Formats a list of reminders for display, sorted by time proximity"""
@@ -141,13 +199,15 @@ def format_reminder_list_by_time(reminders, include_cancel_instructions=True):
         return "Você não tem lembretes ativos no momento."
     
     # Sort reminders by scheduled time
-    sorted_reminders = sorted(reminders, key=lambda r: datetime.fromisoformat(r['scheduled_time'].replace('Z', '+00:00')))
+    sorted_reminders = sorted(reminders, key=parse_scheduled_time)
     
-    response = "📋 *Seus lembretes:*\n"
-    for i, reminder in enumerate(sorted_reminders, 1):
-        scheduled_time = datetime.fromisoformat(reminder['scheduled_time'].replace('Z', '+00:00'))
-        formatted_time = format_datetime(scheduled_time)
-        response += f"{i}. *{reminder['title']}* - {formatted_time}\n"
+    now = datetime.now(BRAZIL_TIMEZONE)
+    lines = ["📋 *Seus lembretes:*"]
+    lines.extend(
+        f"{i}. *{reminder['title']}* - {format_datetime(parse_scheduled_time(reminder), now)}"
+        for i, reminder in enumerate(sorted_reminders, 1)
+    )
+    response = "\n".join(lines) + "\n"
     
     if include_cancel_instructions:
         response += "\nPara cancelar um lembrete, envie 'cancelar lembrete 2' (usando o número) ou 'cancelar lembrete [título]' (usando o nome)"
@@ -166,7 +226,10 @@ def format_created_reminders(created_reminders):
         reminder = sorted_reminders[0]
         return f"✅ Lembrete criado: *{reminder['title']}* para {format_datetime(reminder['time'])}"
     else:
-        response = f"✅ {len(sorted_reminders)} lembretes criados:\n\n"
-        for i, reminder in enumerate(sorted_reminders, 1):
-            response += f"{i}. *{reminder['title']}* - {format_datetime(reminder['time'])}\n"
-        return response
+        now = datetime.now(BRAZIL_TIMEZONE)
+        lines = [f"✅ {len(sorted_reminders)} lembretes criados:", ""]
+        lines.extend(
+            f"{i}. *{reminder['title']}* - {format_datetime(reminder['time'], now)}"
+            for i, reminder in enumerate(sorted_reminders, 1)
+        )
+        return "\n".join(lines) + "\n"
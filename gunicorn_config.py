@@ -1,6 +1,12 @@
 # Gunicorn configuration
-bind = "0.0.0.0:5000"
-workers = 2
-threads = 4
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Requests spend most of their time waiting on Twilio/OpenAI/Supabase, so threads are cheap
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
 timeout = 60  # Increase timeout to 60 seconds
-worker_class = "gthread" 
\ No newline at end of file
+worker_class = "gthread"
+# Background threads (message sender, reminder checker) are started on import and
+# must run in each worker, not in a preloaded master that forks them away
+preload_app = False
@@ -0,0 +1,21 @@
+-- Atomically claims due reminders for sending.
+-- Due reminders (scheduled up to the end of the current minute) are marked inactive
+-- and returned in one statement. FOR UPDATE SKIP LOCKED lets concurrent checkers
+-- claim disjoint batches instead of sending the same reminder twice.
+create or replace function claim_due_reminders(n integer default 100)
+returns setof reminders
+language sql
+as $$
+    update reminders
+    set is_active = false
+    where id in (
+        select id
+        from reminders
+        where is_active
+          and scheduled_time < date_trunc('minute', now()) + interval '1 minute'
+        order by scheduled_time
+        limit n
+        for update skip locked
+    )
+    returning *;
+$$;
@@ -0,0 +1,6 @@
+-- Partial index backing the due-reminder lookups (claim_due_reminders and the
+-- next-wakeup query). Only active reminders are ever searched by time, so sent and
+-- cancelled rows stay out of the index.
+create index if not exists reminders_active_scheduled_time_idx
+    on reminders (scheduled_time)
+    where is_active;
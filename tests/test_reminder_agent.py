@@ -0,0 +1,72 @@
+"""
+Tests for the reminder sweep in ReminderAgent.check_and_send_reminders.
+Run with: python -m unittest discover tests
+"""
+import sys
+import types
+import unittest
+from unittest import mock
+
+from postgrest.exceptions import APIError
+
+# utils.database creates the Supabase client from the environment on import; the
+# tests patch the reminder_db helpers instead, so a placeholder client is enough
+if 'utils.database' not in sys.modules:
+    _database = types.ModuleType('utils.database')
+    _database.supabase = mock.MagicMock()
+    sys.modules['utils.database'] = _database
+
+from agents.reminder_agent import reminder_db
+from agents.reminder_agent.reminder_agent import ReminderAgent
+
+def _api_error(message):
+    return APIError({'message': message, 'code': 'PGRST202', 'hint': None, 'details': None})
+
+class CheckAndSendRemindersTest(unittest.TestCase):
+    def setUp(self):
+        self.send_message = mock.MagicMock(return_value=True)
+        self.agent = ReminderAgent(send_message_func=self.send_message)
+    
+    def test_failing_claim_rpc_reports_error(self):
+        supabase = mock.MagicMock()
+        supabase.rpc.return_value.execute.side_effect = _api_error('function claim_due_reminders does not exist')
+        
+        with mock.patch.object(reminder_db, 'supabase', supabase):
+            result = self.agent.check_and_send_reminders()
+        
+        self.assertEqual(result['status'], 'error')
+        self.assertIn('claim_due_reminders', result['error'])
+        self.assertEqual(result['sent_count'], 0)
+        self.send_message.assert_not_called()
+    
+    def test_failing_reactivation_reports_error(self):
+        reminder = {
+            'id': 1,
+            'user_phone': '+5511999999999',
+            'title': 'pagar a conta',
+            'scheduled_time': '2026-10-16T12:00:00+00:00'
+        }
+        self.send_message.return_value = False
+        
+        supabase = mock.MagicMock()
+        supabase.rpc.return_value.execute.return_value.data = [reminder]
+        supabase.table.return_value.update.return_value.in_.return_value.execute.side_effect = \
+            _api_error('connection refused')
+        
+        with mock.patch.object(reminder_db, 'supabase', supabase):
+            result = self.agent.check_and_send_reminders()
+        
+        self.assertEqual(result['status'], 'error')
+    
+    def test_lock_is_released_after_error(self):
+        supabase = mock.MagicMock()
+        supabase.rpc.return_value.execute.side_effect = _api_error('service unavailable')
+        
+        with mock.patch.object(reminder_db, 'supabase', supabase):
+            self.agent.check_and_send_reminders()
+        
+        self.assertTrue(self.agent.check_lock.acquire(blocking=False))
+        self.agent.check_lock.release()
+
+if __name__ == '__main__':
+    unittest.main()
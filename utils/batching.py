@@ -0,0 +1,99 @@
+"""
+Batching utilities.
+This file provides the background worker that groups queued items into batches.
+"""
+import logging
+import queue
+from abc import ABC, abstractmethod
+import threading
+import time as time_module
+
+logger = logging.getLogger(__name__)
+
+# Queued by stop() to end the worker loop
+_STOP = object()
+
+class BatchWorker(ABC):
+    """
+    Collects queued items on a background thread and hands them to process_batch.
+    A batch is handed over when it reaches max_batch_size items or max_wait seconds
+    after its first item. Subclasses implement process_batch.
+    """
+
+    def __init__(self, name, max_batch_size, max_wait):
+        """Set the batch limits; the thread starts on the first submit"""
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue an item for the next batch"""
+        self._ensure_worker()
+        self._queue.put(item)
+
+    def stop(self, timeout=None):
+        """Stop the thread once it has processed the items it already took from the queue"""
+        with self._worker_lock:
+            worker = self._worker
+            if worker is None or not worker.is_alive():
+                return
+            self._queue.put(_STOP)
+        worker.join(timeout)
+
+    def drain(self):
+        """Remove and return every item still queued"""
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.append(item)
+
+    @abstractmethod
+    def process_batch(self, batch):
+        """Handle one batch of items"""
+
+    def _ensure_worker(self):
+        """Start the thread in this process if it is not running"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True, name=self.name)
+                self._worker.start()
+
+    def _run(self):
+        """Collect batches from the queue and process them until stopped"""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = time_module.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time_module.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                logger.error(f"Error processing batch in {self.name}: {str(e)}")
+
+            if stopping:
+                return
@@ -3,34 +3,53 @@ Datetime utility functions.
 This file provides datetime-related helper functions used throughout the application.
 """
 import logging
-import pytz
+import sys
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 
 logger = logging.getLogger(__name__)
 
-# Define Brazil timezone
-BRAZIL_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+# Define Brazil timezone (zoneinfo tzinfos are attached directly, no pytz localize() step)
+BRAZIL_TIMEZONE = ZoneInfo('America/Sao_Paulo')
+
+# Prefer the C parser from ciso8601 for ISO 8601 timestamps (it handles the 'Z' suffix natively)
+try:
+    from ciso8601 import parse_datetime as parse_iso_datetime
+except ImportError:
+    if sys.version_info >= (3, 11):
+        # fromisoformat accepts the 'Z' suffix natively from Python 3.11
+        parse_iso_datetime = datetime.fromisoformat
+    else:
+        def parse_iso_datetime(value):
+            """Parses an ISO 8601 timestamp, used when ciso8601 is not installed"""
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
 
 def to_local_timezone(utc_dt):
     """Converts a UTC datetime to local timezone (Brazil)"""
     if utc_dt.tzinfo is None:
         utc_dt = utc_dt.replace(tzinfo=timezone.utc)
+    elif utc_dt.tzinfo is BRAZIL_TIMEZONE:
+        # Already local; ZoneInfo instances are cached, so identity is enough
+        return utc_dt
     return utc_dt.astimezone(BRAZIL_TIMEZONE)
 
 def to_utc_timezone(local_dt):
     """Converts a local datetime to UTC"""
     if local_dt.tzinfo is None:
         # Assume it's local time
-        local_dt = BRAZIL_TIMEZONE.localize(local_dt)
+        local_dt = local_dt.replace(tzinfo=BRAZIL_TIMEZONE)
     return local_dt.astimezone(timezone.utc)
 
-def format_datetime(dt):
-    """Formats a datetime for user-friendly display in Portuguese"""
+def format_datetime(dt, _now=None):
+    """
+    Formats a datetime for user-friendly display in Portuguese.
+    Callers formatting many datetimes can pass _now, computed once, to skip the clock lookup.
+    """
     # Convert to local timezone
     local_dt = to_local_timezone(dt)
     
     # Get current date in local timezone
-    now = datetime.now(BRAZIL_TIMEZONE)
+    now = _now or datetime.now(BRAZIL_TIMEZONE)
     today = now.date()
     tomorrow = today + timedelta(days=1)
     
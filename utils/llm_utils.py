@@ -0,0 +1,28 @@
+"""
+LLM utility functions.
+This file provides the shared OpenAI client used throughout the application.
+"""
+import logging
+import threading
+import httpx
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive pool shared by every thread, so calls reuse open TLS connections;
+# HTTP/2 lets concurrent requests share a single connection
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+def get_openai_client():
+    """Return the process-wide OpenAI client, creating it on first use"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                # Created lazily so OPENAI_API_KEY is read after the app loads its environment
+                _openai_client = OpenAI(http_client=httpx.Client(http2=True, limits=HTTP_LIMITS))
+                logger.info("Shared OpenAI client created")
+    return _openai_client
@@ -1,16 +1,26 @@
 """
 Media utilities for processing images and audio files.
 """
-import os
 import logging
 import requests
-import tempfile
 import base64
-import openai
 from io import BytesIO
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.llm_utils import get_openai_client
+from utils.whatsapp_utils import TWILIO_AUTH
 
 logger = logging.getLogger(__name__)
 
+# Twilio media URLs require the account credentials; one pooled session keeps the
+# TLS connection to Twilio open between downloads and retries transient failures.
+# It is separate from whatsapp_utils.http_session, whose sends must not be replayed
+# by transport-level retries
+_media_session = requests.Session()
+_media_session.auth = TWILIO_AUTH
+_media_session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=2, backoff_factor=0.1)))
+
 def process_image(image_url):
     """
     Process an image using OpenAI's vision model.
@@ -25,16 +35,16 @@ def process_image(image_url):
         logger.info(f"Processing image from URL: {image_url}")
         
         # Download the image
-        response = requests.get(image_url)
+        response = _media_session.get(image_url, timeout=10)
         if response.status_code != 200:
             logger.error(f"Failed to download image: {response.status_code}")
             return "Não consegui baixar a imagem."
         
-        # Convert to base64
-        image_data = base64.b64encode(response.content).decode('utf-8')
+        # Build the data URL in one step; base64 output is pure ASCII
+        image_url_data = "data:image/jpeg;base64," + base64.b64encode(response.content).decode('ascii')
         
-        # Use OpenAI API directly
-        response = openai.ChatCompletion.create(
+        client = get_openai_client()
+        response = client.chat.completions.create(
             model="gpt-4o",  # Use a model with vision capabilities
             messages=[
                 {
@@ -48,7 +58,7 @@ def process_image(image_url):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
+                                "url": image_url_data
                             }
                         }
                     ]
@@ -79,35 +89,30 @@ def transcribe_audio(audio_url):
     try:
         logger.info(f"Transcribing audio from URL: {audio_url}")
         
-        # Download the audio file
-        response = requests.get(audio_url)
-        if response.status_code != 200:
-            logger.error(f"Failed to download audio: {response.status_code}")
-            return "Não consegui baixar o áudio."
+        # Download the audio file, streaming it into memory as it arrives; the
+        # name tells the API the audio format
+        audio_file = BytesIO()
+        audio_file.name = 'audio.ogg'
+        with _media_session.get(audio_url, timeout=10, stream=True) as response:
+            if response.status_code != 200:
+                logger.error(f"Failed to download audio: {response.status_code}")
+                return "Não consegui baixar o áudio."
+            
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                audio_file.write(chunk)
+        audio_file.seek(0)
         
-        # Save to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
-            temp_file.write(response.content)
-            temp_path = temp_file.name
+        client = get_openai_client()
+        transcript = client.audio.transcriptions.create(
+            model="whisper-1",
+            file=audio_file,
+            language="pt"
+        )
         
-        try:
-            # Use OpenAI API directly
-            with open(temp_path, "rb") as audio_file:
-                transcript = openai.Audio.transcribe(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="pt"
-                )
-            
-            transcription = transcript.text
-            logger.info(f"Generated transcription: {transcription[:100]}... (truncated)")
-            
-            return transcription
-            
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        transcription = transcript.text
+        logger.info(f"Generated transcription: {transcription[:100]}... (truncated)")
+        
+        return transcription
         
     except Exception as e:
         logger.error(f"Error transcribing audio: {str(e)}")
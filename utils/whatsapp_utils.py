@@ -2,26 +2,258 @@
 WhatsApp utility functions.
 This file provides functions for interacting with the WhatsApp API via Twilio.
 """
+import heapq
+import itertools
 import logging
 import os
+import random
 import requests
 import threading
 import time as time_module
 import queue
-from flask import request, jsonify
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from flask import request, jsonify, Response
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from twilio.rest import Client
-from twilio.twiml.messaging_response import MessagingResponse
+from twilio.http.http_client import TwilioHttpClient
 from twilio.base.exceptions import TwilioRestException
 
 logger = logging.getLogger(__name__)
 
+# Optional Redis backend for the message queue
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Sends are I/O bound, so several workers consume message_queue in parallel
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', '8'))
+
+# Keep-alive session shared by the Twilio client and other outgoing HTTP calls.
+# The pool is sized so every sender worker can hold its own connection.
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=max(16, WORKER_THREADS), max_retries=0))
+
+# Twilio credentials, read once; also used to download media from Twilio's servers
+TWILIO_AUTH = (os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
+
 # Initialize Twilio client
-twilio_client = Client(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
+_twilio_http_client = TwilioHttpClient()
+_twilio_http_client.session = http_session
+twilio_client = Client(*TWILIO_AUTH, http_client=_twilio_http_client)
 
-# Message retry queue
-message_queue = queue.Queue()
+# Sender address, resolved once instead of on every outgoing message
+TWILIO_FROM = f"whatsapp:{os.getenv('TWILIO_PHONE_NUMBER')}"
+if not os.getenv('TWILIO_PHONE_NUMBER'):
+    # Surface the misconfiguration at startup rather than on the first failed send
+    logger.warning("TWILIO_PHONE_NUMBER is not set; outgoing WhatsApp messages will fail")
+
+class RedisMessageQueue:
+    """
+    Message queue stored in a Redis list, exposing the part of the queue.Queue
+    interface used here. Delayed retries wait in a sorted set scored by due time.
+    """
+    
+    def __init__(self, client, maxsize=0, key='wa:send', delayed_key='wa:delayed'):
+        """Wrap a Redis client; maxsize bounds put_nowait like queue.Queue"""
+        self.client = client
+        self.maxsize = maxsize
+        self.key = key
+        self.delayed_key = delayed_key
+    
+    def put(self, message_data, block=True):
+        """Append a message; only non-blocking puts enforce maxsize"""
+        if not block and self.maxsize and self.client.llen(self.key) >= self.maxsize:
+            raise queue.Full
+        self.client.lpush(self.key, orjson.dumps(message_data))
+    
+    def put_nowait(self, message_data):
+        """Append a message, raising queue.Full if the queue is at maxsize"""
+        self.put(message_data, block=False)
+    
+    def get(self):
+        """Block until a message is available and return it"""
+        _, data = self.client.brpop(self.key)
+        return orjson.loads(data)
+    
+    def task_done(self):
+        """Nothing to track: a message leaves Redis as soon as it is popped"""
+    
+    def put_later(self, message_data, delay):
+        """Schedule a message to be queued again after delay seconds"""
+        # A unique id keeps identical messages from collapsing into one set member
+        message_data.setdefault('id', uuid.uuid4().hex)
+        self.client.zadd(self.delayed_key, {orjson.dumps(message_data): time_module.time() + delay})
+    
+    def move_due(self, limit=100):
+        """Move delayed messages whose time has come back onto the queue"""
+        due = self.client.zrangebyscore(self.delayed_key, 0, time_module.time(), start=0, num=limit)
+        for data in due:
+            # ZREM succeeds in exactly one process, so each message is moved once
+            if self.client.zrem(self.delayed_key, data):
+                self.client.lpush(self.key, data)
+
+# Message retry queue, bounded so a backlog (e.g. during rate limiting) can't grow without limit.
+# With REDIS_URL set, queued and delayed messages live in Redis instead, so they survive
+# restarts and are shared by every worker process.
+QUEUE_MAX = int(os.getenv('QUEUE_MAX', '1000'))
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL and redis is not None:
+    message_queue = RedisMessageQueue(redis.Redis.from_url(REDIS_URL), maxsize=QUEUE_MAX)
+else:
+    if REDIS_URL:
+        logger.warning("REDIS_URL is set but the redis package is not installed, using an in-memory queue")
+    message_queue = queue.Queue(maxsize=QUEUE_MAX)
 MAX_RETRIES = 3
-RETRY_DELAY = 5  # seconds
+RETRY_BASE_DELAY = 0.5  # seconds
+RETRY_MAX_DELAY = 60  # seconds
+
+def _retry_delay(retry_count):
+    """Exponential backoff with full jitter, so failed sends don't retry in lockstep"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** retry_count)))
+
+# Messages waiting for their retry delay (and calls scheduled with schedule_call), as
+# (due monotonic time, seq, message_data or callable); a single scheduler thread moves
+# messages back onto message_queue and runs calls when they are due
+_delay_heap = []
+_delay_cv = threading.Condition()
+_delay_seq = itertools.count()
+
+# Callbacks run with the message data of a message given up on after MAX_RETRIES
+# transient failures, so its sender can hand the work back (e.g. reactivate a reminder)
+_dropped_message_handlers = []
+
+def on_message_dropped(handler):
+    """Register a callback for messages given up on after repeated transient failures"""
+    _dropped_message_handlers.append(handler)
+
+def _schedule_retry(message_data):
+    """Re-queue a failed message after a backoff delay, without blocking the worker"""
+    retry_count = message_data.get('retry_count', 0)
+    if retry_count >= MAX_RETRIES:
+        logger.error(f"Max retries ({MAX_RETRIES}) reached, dropping message")
+        for handler in _dropped_message_handlers:
+            try:
+                handler(message_data)
+            except Exception as e:
+                logger.error(f"Error in dropped message handler: {str(e)}")
+        return
+    
+    delay = _retry_delay(retry_count)
+    message_data['retry_count'] = retry_count + 1
+    logger.info(f"Re-queueing message in {delay:.1f}s (retry {retry_count+1}/{MAX_RETRIES})")
+    if isinstance(message_queue, RedisMessageQueue):
+        message_queue.put_later(message_data, delay)
+        return
+    
+    with _delay_cv:
+        heapq.heappush(_delay_heap, (time_module.monotonic() + delay, next(_delay_seq), message_data))
+        _delay_cv.notify()
+
+def schedule_call(delay, func):
+    """Run func on the scheduler thread after delay seconds; it must be quick and not block"""
+    with _delay_cv:
+        heapq.heappush(_delay_heap, (time_module.monotonic() + delay, next(_delay_seq), func))
+        _delay_cv.notify()
+
+def delay_scheduler_worker():
+    """Background worker that puts delayed messages back on the queue once they are due"""
+    logger.info("Delay scheduler worker started")
+    while True:
+        with _delay_cv:
+            if not _delay_heap:
+                _delay_cv.wait()
+                continue
+            
+            wait_time = _delay_heap[0][0] - time_module.monotonic()
+            if wait_time > 0:
+                # Woken early by notify() when a sooner retry is pushed
+                _delay_cv.wait(timeout=wait_time)
+                continue
+            payload = heapq.heappop(_delay_heap)[2]
+        
+        if callable(payload):
+            try:
+                payload()
+            except Exception as e:
+                logger.error(f"Error in scheduled call: {str(e)}")
+            continue
+        
+        # Put outside the lock: with a full queue this blocks until the workers
+        # drain it, and they must still be able to schedule retries meanwhile
+        message_queue.put(payload)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Caps how many sends run at once, adjusted AIMD-style: the limit is halved
+    when Twilio rate limits us and grows by one after a run of successful sends.
+    """
+    
+    def __init__(self, initial, minimum=2, success_threshold=10):
+        """Start at the initial limit; it can grow back up to that value"""
+        self.maximum = initial
+        self.minimum = min(minimum, initial)
+        self.limit = initial
+        self.success_threshold = success_threshold
+        self._in_flight = 0
+        self._successes = 0
+        self._cv = threading.Condition()
+    
+    def acquire(self):
+        """Block until another send may start"""
+        with self._cv:
+            while self._in_flight >= self.limit:
+                self._cv.wait()
+            self._in_flight += 1
+    
+    def release(self):
+        """Mark a send as finished"""
+        with self._cv:
+            self._in_flight -= 1
+            self._cv.notify()
+    
+    def on_success(self):
+        """Additive increase after success_threshold consecutive successes"""
+        with self._cv:
+            self._successes += 1
+            if self._successes >= self.success_threshold and self.limit < self.maximum:
+                self._successes = 0
+                self.limit += 1
+                logger.info(f"Send concurrency raised to {self.limit}")
+                self._cv.notify()
+    
+    def on_rate_limited(self):
+        """Multiplicative decrease when Twilio rejects a send with 429"""
+        with self._cv:
+            self._successes = 0
+            new_limit = max(self.minimum, self.limit // 2)
+            if new_limit < self.limit:
+                self.limit = new_limit
+                logger.warning(f"Send concurrency lowered to {self.limit}")
+
+send_limiter = AdaptiveConcurrencyLimiter(WORKER_THREADS)
+
+def redis_delay_scheduler_worker():
+    """Background worker that moves due retries from the Redis delayed set to the queue"""
+    logger.info("Redis delay scheduler worker started")
+    while True:
+        try:
+            message_queue.move_due()
+        except Exception as e:
+            logger.error(f"Error moving delayed messages: {str(e)}")
+        time_module.sleep(0.5)
+
+def _failed_before_sending(error):
+    """Whether a requests connection error happened while connecting, before the request was sent"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # Connection refusals and DNS failures arrive as a MaxRetryError wrapping a NewConnectionError
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NewConnectionError)
 
 def message_sender_worker():
     """Background worker that processes the message queue and handles retries"""
@@ -57,33 +289,43 @@ def message_sender_worker():
                 
                 # Send or resend the message
                 logger.info(f"Sending message to {to_number}: {body[:30]}...")
-                message = twilio_client.messages.create(
-                    body=body,
-                    from_=f"whatsapp:{os.getenv('TWILIO_PHONE_NUMBER')}",
-                    to=to_number
-                )
+                send_limiter.acquire()
+                try:
+                    message = twilio_client.messages.create(
+                        body=body,
+                        from_=TWILIO_FROM,
+                        to=to_number
+                    )
+                finally:
+                    send_limiter.release()
                 
+                send_limiter.on_success()
                 logger.info(f"Message sent successfully: {message.sid} (status: {message.status})")
                 message_queue.task_done()
             except TwilioRestException as e:
                 logger.error(f"Twilio error sending message: {str(e)}")
                 
-                # Handle rate limiting
-                if e.code == 20429:
-                    logger.warning("Rate limit exceeded, will retry later")
-                    # Increase retry count
-                    message_data['retry_count'] = retry_count + 1
-                    # Add back to queue if under max retries
-                    if retry_count < MAX_RETRIES:
-                        logger.info(f"Re-queueing message (retry {retry_count+1}/{MAX_RETRIES})")
-                        time_module.sleep(RETRY_DELAY)
-                        message_queue.put(message_data)
-                    else:
-                        logger.error(f"Max retries ({MAX_RETRIES}) reached, dropping message")
+                # Only rate limiting and server errors are worth retrying; other
+                # errors (invalid number, auth) would fail the same way again
+                if e.code == 20429 or e.status == 429:
+                    send_limiter.on_rate_limited()
+                if e.code == 20429 or e.status == 429 or e.status >= 500:
+                    logger.warning(f"Transient Twilio error ({e.status}), will retry later")
+                    _schedule_retry(message_data)
                 else:
                     logger.error(f"Unhandled Twilio error: {e.code} - {e.msg}")
                 
                 message_queue.task_done()
+            except requests.ConnectionError as e:
+                logger.error(f"Connection error sending message: {str(e)}")
+                if _failed_before_sending(e):
+                    # The request never reached Twilio, so resending can't duplicate it
+                    _schedule_retry(message_data)
+                else:
+                    # The connection broke after the request was written (aborted or
+                    # remote disconnect); Twilio may have accepted it, so don't resend
+                    logger.error(f"Not retrying message to {to_number}: it may already have been sent")
+                message_queue.task_done()
             except Exception as e:
                 logger.error(f"Error sending message: {str(e)}")
                 message_queue.task_done()
@@ -93,20 +335,40 @@ def message_sender_worker():
             # Don't break the loop on error
             time_module.sleep(1)
 
+_sender_threads = {}
+_sender_lock = threading.Lock()
+
 def start_message_sender():
-    """Start the background message sender thread"""
-    logger.info("Starting message sender worker thread...")
-    message_sender_thread = threading.Thread(target=message_sender_worker, daemon=True)
-    message_sender_thread.start()
-    return message_sender_thread
-
-def send_whatsapp_message(to_number, body):
-    """Send a WhatsApp message using Twilio"""
+    """Start the background message sender threads that are not already running"""
+    # The in-memory scheduler also runs schedule_call jobs, so it runs in Redis mode too
+    targets = {'msg-delay-scheduler': delay_scheduler_worker}
+    if isinstance(message_queue, RedisMessageQueue):
+        targets['msg-redis-scheduler'] = redis_delay_scheduler_worker
+    for i in range(WORKER_THREADS):
+        targets[f'msg-sender-{i}'] = message_sender_worker
+    
+    with _sender_lock:
+        for name, target in targets.items():
+            thread = _sender_threads.get(name)
+            if thread is None or not thread.is_alive():
+                logger.info(f"Starting {name} thread...")
+                thread = threading.Thread(target=target, daemon=True, name=name)
+                thread.start()
+                _sender_threads[name] = thread
+        
+        return list(_sender_threads.values())
+
+def send_whatsapp_message(to_number, body, context=None):
+    """
+    Send a WhatsApp message using Twilio.
+    context is an optional JSON-serializable dict kept with the queued message and
+    passed back to the dropped message handlers.
+    """
     try:
         # Ensure the number has the whatsapp: prefix
         if not to_number.startswith('whatsapp:'):
-            to_number = f'whatsapp:{to_number}'
-            
+            to_number = 'whatsapp:' + to_number
+
         # Add the message to the queue
         logger.info(f"Queueing message to {to_number}")
         message_data = {
@@ -114,29 +376,17 @@ def send_whatsapp_message(to_number, body):
             'body': body,
             'retry_count': 0
         }
-        message_queue.put(message_data)
+        if context:
+            message_data['context'] = context
+        message_queue.put_nowait(message_data)
         return True
+    except queue.Full:
+        logger.error(f"Message queue is full ({QUEUE_MAX}), dropping message to {to_number}")
+        return False
     except Exception as e:
         logger.error(f"Error queueing message: {str(e)}")
         return False
 
-def download_media(media_url):
-    """Download media from Twilio's servers"""
-    try:
-        logger.info(f"Downloading media from: {media_url}")
-        
-        # Download the media WITH AUTHENTICATION
-        auth = (os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
-        media_response = requests.get(media_url, auth=auth)
-        
-        if media_response.status_code != 200:
-            raise Exception(f"Failed to download media: {media_response.status_code}")
-        
-        return media_response.content
-    except Exception as e:
-        logger.error(f"Error downloading media: {str(e)}")
-        return None
-
 def parse_twilio_request(request):
     """Parse a Twilio webhook request and extract relevant data"""
     try:
@@ -183,6 +433,15 @@ def parse_twilio_request(request):
 
 # New functions moved from whatsapp-agent-python.py
 
+# The webhook only acknowledges the message (replies are sent through the API),
+# so its TwiML body never changes
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+# Incoming messages are processed on a bounded pool of reused threads; a burst of
+# webhooks queues in the executor instead of starting one thread per message
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '32'))
+webhook_executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix='webhook')
+
 def webhook_handler(request, process_message_callback, intent_classifier=None, reminder_agent=None):
     """Webhook endpoint handler for Twilio WhatsApp messages"""
     try:
@@ -195,43 +454,63 @@ def webhook_handler(request, process_message_callback, intent_classifier=None, r
         # Log the incoming message
         logger.info(f"Received message from {from_number}: {body[:50]}... (truncated)")
         
-        # Send an acknowledgment response
-        resp = MessagingResponse()
-        
         # Process the message asynchronously
-        threading.Thread(
-            target=process_message_callback,
-            args=(from_number, body, num_media, twilio_data['raw_form'])
-        ).start()
+        webhook_executor.submit(process_message_callback, from_number, body, num_media, twilio_data['raw_form'])
         
-        return str(resp)
+        # Send an acknowledgment response
+        return Response(EMPTY_TWIML, mimetype='text/xml')
     except Exception as e:
         logger.error(f"Error in webhook: {str(e)}")
         return "Error", 500
 
+def json_response(payload, status=200):
+    """Build a JSON response serialized with orjson"""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
 def send_direct_message_handler(request):
     """Handler for sending messages outside of the webhook context"""
     try:
-        data = request.json
-        to_number = data.get('to')
-        body = data.get('body')
-        
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            return json_response({"error": "Invalid JSON body"}, 400)
+
+        to_number = data.get('to') if isinstance(data, dict) else None
+        body = data.get('body') if isinstance(data, dict) else None
+
         if not to_number or not body:
-            return {"error": "Missing 'to' or 'body' parameters"}, 400
-            
+            return json_response({"error": "Missing 'to' or 'body' parameters"}, 400)
+
         # Queue the message with our retry mechanism
-        send_whatsapp_message(to_number, body)
-        
-        return {"status": "queued"}, 200
+        if not send_whatsapp_message(to_number, body):
+            return json_response({"error": "Message queue is full"}, 503)
+
+        return json_response({"status": "queued"})
     except Exception as e:
         logger.error(f"Error in send_message endpoint: {str(e)}")
-        return {"error": str(e)}, 500
+        return json_response({"error": str(e)}, 500)
 
-def process_message_async(from_number, body, num_media, form_values, intent_classifier, reminder_agent, handle_message, get_ai_response, process_image, transcribe_audio):
+# Generates general-conversation replies speculatively while the intent LLM call runs
+speculative_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='speculative-reply')
+
+def _handle_reminder_or_ai(user_phone, text, intent_classifier, reminder_agent, response_future=None):
+    """Answer a reminder request, or return None so the caller falls back to the AI reply"""
+    intent_type, intent_details = intent_classifier.detect_intent(text)
+    
+    if intent_type != "reminder":
+        logger.info("No reminder intent detected, handling as general conversation")
+        return None
+    
+    logger.info(f"Reminder intent detected")
+    if response_future is not None:
+        response_future.cancel()
+    return reminder_agent.handle_reminder_intent(user_phone, text, intent_details)
+
+def process_message_async(from_number, body, num_media, form_values, intent_classifier, reminder_agent, handle_message, get_ai_response, process_image, transcribe_audio, prepare_response=None):
     """Process a message asynchronously after sending an acknowledgment"""
     try:
         # Extract the phone number without the "whatsapp:" prefix
-        user_phone = from_number.replace('whatsapp:', '')
+        user_phone = from_number.removeprefix('whatsapp:')
         
         response_text = None
         
@@ -259,25 +538,19 @@ def process_message_async(from_number, body, num_media, form_values, intent_clas
                 logger.info(f"Processing audio from {from_number}")
                 transcribed_text = transcribe_audio(media_items[0][0])
                 
-                # Check for intent in transcription
-                intent_type, _ = intent_classifier.detect_intent(transcribed_text)
-                
-                if intent_type == "reminder":
-                    response_text = reminder_agent.handle_reminder_intent(user_phone, transcribed_text)
-                else:
+                response_text = _handle_reminder_or_ai(user_phone, transcribed_text, intent_classifier, reminder_agent)
+                if response_text is None:
                     response_text = get_ai_response(transcribed_text, is_audio_transcription=True)
         else:
-            # Check for intent
-            intent_type, _ = intent_classifier.detect_intent(body)
+            # When the intent needs an LLM call, start the general reply at the same time
+            # so the two round-trips overlap; it is discarded if the intent is a reminder
+            response_future = None
+            if prepare_response is not None and intent_classifier.needs_llm(body):
+                response_future = speculative_executor.submit(prepare_response, user_phone, body)
             
-            if intent_type == "reminder":
-                # Handle reminder intent
-                logger.info(f"Reminder intent detected")
-                response_text = reminder_agent.handle_reminder_intent(user_phone, body)
-            else:
-                # Handle general conversation
-                logger.info("No reminder intent detected, handling as general conversation")
-                response_text = handle_message(user_phone, body)
+            response_text = _handle_reminder_or_ai(user_phone, body, intent_classifier, reminder_agent, response_future)
+            if response_text is None:
+                response_text = handle_message(user_phone, body, response_future=response_future)
         
         # Send the response
         if response_text:
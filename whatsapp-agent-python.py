@@ -1,6 +1,9 @@
 from flask import Flask, request, jsonify
 from datetime import datetime, timezone, timedelta, time
 import os
+import fcntl
+import hmac
+import tempfile
 import requests
 import threading
 import time as time_module
@@ -15,19 +18,20 @@ from utils.database import supabase
 from agents.general_agent.general_db import store_conversation, get_conversation_history
 from agents.reminder_agent.reminder_db import (
     list_reminders, create_reminder, cancel_reminder, 
-    get_pending_reminders, get_late_reminders,
     format_reminder_list_by_time, format_created_reminders,
     to_local_timezone, to_utc_timezone, format_datetime,
     BRAZIL_TIMEZONE
 )
-from agents.general_agent.general_agent import get_ai_response, handle_message, get_conversation_context
+from agents.general_agent.general_agent import get_ai_response, handle_message, get_conversation_context, prepare_response
 from agents.reminder_agent.reminder_agent import ReminderAgent
 from agents.intent_agent import IntentAgent
 from utils.whatsapp_utils import (
     parse_twilio_request, send_whatsapp_message, start_message_sender,
-    webhook_handler, send_direct_message_handler, process_message_async
+    webhook_handler, send_direct_message_handler, process_message_async,
+    json_response, http_session, schedule_call, on_message_dropped
 )
 from utils.media_utils import process_image, transcribe_audio
+from utils.llm_utils import get_openai_client
 
 # Configure logging
 log_level = os.getenv('LOG_LEVEL', 'INFO')
@@ -55,6 +59,9 @@ logging.getLogger().addFilter(HealthCheckFilter())
 # Load environment variables
 load_dotenv()
 
+# API key for /api/check-reminders, read once and compared in constant time
+REMINDER_API_KEY = (os.getenv('REMINDER_API_KEY') or '').encode()
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -69,10 +76,8 @@ def initialize_openai(api_key):
         # Set the API key for the new OpenAI client
         os.environ["OPENAI_API_KEY"] = api_key
         
-        # Test the client
-        from openai import OpenAI
-        client = OpenAI()
-        models = client.models.list()
+        # Test the shared client (created on first use, after the key is set)
+        models = get_openai_client().models.list()
         
         logger.info("OpenAI client initialized successfully")
         return True
@@ -89,6 +94,8 @@ intent_agent = IntentAgent()
 
 # Initialize the ReminderAgent
 reminder_agent = ReminderAgent(send_message_func=send_whatsapp_message)
+# Reminders whose message is given up on after repeated failures go back to the next sweep
+on_message_dropped(reminder_agent.handle_dropped_message)
 
 # Use a lazy initialization pattern:
 _twilio_client = None
@@ -101,33 +108,75 @@ def get_twilio_client():
 
 # ===== EXISTING FUNCTIONS =====
 
+APP_URL = os.getenv('APP_URL', 'https://secretaria-app.onrender.com')
+SELF_PING_INTERVAL = 600  # seconds
+
 def ping_self():
-    app_url = os.getenv('APP_URL', 'https://secretaria-app.onrender.com')
+    """Ping the app so the host doesn't idle it, then schedule the next ping"""
+    try:
+        http_session.get(APP_URL, timeout=5)
+        logger.info(f"Self-ping successful")
+    except Exception as e:
+        logger.error(f"Self-ping failed: {str(e)}")
     
-    while True:
-        try:
-            requests.get(app_url, timeout=5)
-            logger.info(f"Self-ping successful")
-        except Exception as e:
-            logger.error(f"Self-ping failed: {str(e)}")
-        
-        # Sleep for 10 minutes (600 seconds)
-        time_module.sleep(600)
+    schedule_call(SELF_PING_INTERVAL, _start_ping)
+
+def _start_ping():
+    """Run one ping on a short-lived thread, keeping the blocking request off the scheduler thread"""
+    threading.Thread(target=ping_self, daemon=True, name="self-ping").start()
+
+def _hold_process_lock(name):
+    """
+    Try to take an exclusive, non-blocking lock shared by every worker process.
+    Returns True if this process holds it; the lock is released when the process exits,
+    so a replacement worker takes it over on import.
+    """
+    lock_file = open(os.path.join(tempfile.gettempdir(), f"secretaria-{name}.lock"), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Keep the file open for the life of the process, or the lock would be dropped
+    _process_locks.append(lock_file)
+    return True
+
+_process_locks = []
 
-# Start the self-ping in a background thread
+# Only one worker pings; the others would just repeat the same request
 def start_self_ping():
-    ping_thread = threading.Thread(target=ping_self, daemon=True)
-    ping_thread.start()
-    logger.info("Self-ping background thread started")
+    if not _hold_process_lock('self-ping'):
+        logger.info("Self-ping already running in another worker")
+        return
+    schedule_call(0, _start_ping)
+    logger.info("Self-ping scheduled")
 
 # Define a custom process_message function that passes all required dependencies
 def process_message_wrapper(from_number, body, num_media, form_values):
     process_message_async(
         from_number, body, num_media, form_values,
         intent_agent, reminder_agent, handle_message, 
-        get_ai_response, process_image, transcribe_audio
+        get_ai_response, process_image, transcribe_audio, prepare_response
     )
 
+def ensure_message_sender():
+    """Start the message sender threads if they are not running in this process"""
+    # start_message_sender only (re)starts threads that are missing or dead
+    app.message_sender_threads = start_message_sender()
+
+# Every Gunicorn worker imports this module after forking, so each one starts its own
+# sender threads here; otherwise webhook replies would sit in the queue until the first
+# /api/check-reminders call started them
+ensure_message_sender()
+
+# Optionally run the reminder checker in-process instead of relying only on the external
+# cron calling /api/check-reminders. Opt-in because every Gunicorn worker starts its own.
+if os.getenv('ENABLE_REMINDER_CHECKER', 'false').lower() == 'true':
+    reminder_agent.start_reminder_checker()
+
+if os.getenv('ENABLE_SELF_PING', 'false').lower() == 'true':
+    start_self_ping()
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Webhook endpoint for Twilio WhatsApp messages"""
@@ -138,17 +187,19 @@ def send_direct_message():
     """Endpoint to send messages outside of the webhook context"""
     return send_direct_message_handler(request)
 
-# Add this to your startup code
-try:
-    logger.info("Checking Twilio credentials...")
-    account = get_twilio_client().api.accounts(os.getenv('TWILIO_ACCOUNT_SID')).fetch()
-    logger.info(f"Twilio account status: {account.status}")
-    
-    # Try to list messages to verify API access
-    messages = get_twilio_client().messages.list(limit=1)
-    logger.info(f"Successfully retrieved {len(messages)} messages from Twilio")
-except Exception as e:
-    logger.error(f"Error checking Twilio credentials: {str(e)}")
+def verify_twilio_credentials():
+    """Check the Twilio credentials; fetching the account is enough to validate them"""
+    try:
+        logger.info("Checking Twilio credentials...")
+        account = get_twilio_client().api.accounts(os.getenv('TWILIO_ACCOUNT_SID')).fetch()
+        logger.info(f"Twilio account status: {account.status}")
+        return True
+    except Exception as e:
+        logger.error(f"Error checking Twilio credentials: {str(e)}")
+        return False
+
+# Run the check in the background so startup and the first webhooks don't wait on Twilio
+threading.Thread(target=verify_twilio_credentials, daemon=True, name="twilio-credentials-check").start()
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -162,35 +213,23 @@ def api_check_reminders():
     """Endpoint para verificar e enviar lembretes pendentes"""
     try:
         # Verificar autenticação
-        api_key = request.headers.get('X-API-Key')
-        if api_key != os.getenv('REMINDER_API_KEY'):
-            return jsonify({"error": "Unauthorized"}), 401
+        api_key = (request.headers.get('X-API-Key') or '').encode()
+        if not REMINDER_API_KEY or not hmac.compare_digest(api_key, REMINDER_API_KEY):
+            return json_response({"error": "Unauthorized"}, 401)
         
-        # Ensure message sender thread is running
-        if not hasattr(app, 'message_sender_thread') or not app.message_sender_thread.is_alive():
-            logger.info("Starting message sender thread for reminder check")
-            app.message_sender_thread = start_message_sender()
+        ensure_message_sender()
         
         # Processar lembretes using the reminder agent
         result = reminder_agent.check_and_send_reminders()
         
-        return jsonify(result)
+        return json_response(result)
     
     except Exception as e:
         logger.error(f"Error in check-reminders endpoint: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 if __name__ == '__main__':
-    # Start the message sender thread
-    app.message_sender_thread = start_message_sender()
-    
-    # Start the reminder checker thread
-    reminder_checker_thread = reminder_agent.start_reminder_checker()
-    
-    # Start the self-ping thread if needed
-    if os.getenv('ENABLE_SELF_PING', 'false').lower() == 'true':
-        start_self_ping()
-    
-    # Start the Flask app
-    port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    # The Flask development server handles one request at a time; always serve the
+    # app through Gunicorn (see gunicorn_config.py), which runs workers * threads
+    # requests concurrently and starts the background threads in every worker
+    os.execvp('gunicorn', ['gunicorn', '--config', 'gunicorn_config.py', 'whatsapp-agent-python:app'])
\ No newline at end of file